@@ -4,6 +4,7 @@
 : Comment: corrected rates using q10 = 2.3, target temperature 34, orginal 21
 
 NEURON	{
+	THREADSAFE
 	SUFFIX Ca_LVA
 	USEION ca READ eca WRITE ica
 	RANGE gbar, g, ica
@@ -1,6 +1,7 @@
 : Comment: Kv3-like potassium current
 
 NEURON	{
+	THREADSAFE
 	SUFFIX Kv3_1
 	USEION k READ ek WRITE ik
 	RANGE gbar, g, ik 
@@ -1,6 +1,7 @@
 : Reference: Colbert and Pan 2002
 
 NEURON	{
+	THREADSAFE
 	SUFFIX NaTs
 	USEION na READ ena WRITE ina
 	RANGE gbar, g, ina
@@ -2,6 +2,7 @@
 : Reference : Kohler et al. 1996
 
 NEURON {
+       THREADSAFE
        SUFFIX SK
        USEION k READ ek WRITE ik
        USEION ca READ cai
@@ -1,6 +1,7 @@
 :  Vector stream of events
 
 NEURON {
+	THREADSAFE
 	ARTIFICIAL_CELL VecStim
 	POINTER ptr
 }
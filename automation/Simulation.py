@@ -1,8 +1,13 @@
 import numpy as np
-import matplotlib.pyplot as plt
+
+def fixed_step_time(n_samples, dt, t0=0.0):
+    """Sample times (ms) of a trace recorded every step of a fixed-step run that started at t0."""
+    return t0 + np.arange(n_samples) * dt
 
 class RInSimulation:
-    def __init__(self, h, stim_amp=-1.0, stim_delay=100.0, stim_dur=800.0, tstop=1000.0):
+    def __init__(self, h, stim_amp=-1.0, stim_delay=100.0, stim_dur=800.0, tstop=1000.0,
+                 early_stop=False, dvdt_tol=1e-3, chunk_dur=10.0, settled_chunks=2,
+                 rest_state_cache=None, rest_state_key=None, plot=True):
         """
         Initialize the simulation with cell and stimulation parameters.
         
@@ -13,15 +18,52 @@ class RInSimulation:
           stim_dur  : duration of the stimulus (ms)
           tstop     : simulation end time (ms)
           dt        : simulation time step (ms)
+          early_stop: stop the simulation once the somatic voltage settles during the stimulus
+          dvdt_tol  : |dV/dt| below which the soma counts as settled (mV/ms)
+          chunk_dur : time advanced between steady-state checks (ms)
+          settled_chunks: number of consecutive settled chunks required before stopping
+          rest_state_cache: optional RestStateCache; when given, runs start from the cached
+                            resting state at t = 0 instead of settling from -65 mV, so
+                            stim_delay only needs to cover a short baseline
+          rest_state_key  : model key for rest_state_cache (see model_hash.hash_model); the
+                            cache adds the current parameter values, so it can stay fixed while tuning
+          plot      : save the voltage trace of each transient measurement (imports matplotlib)
         """
         self.h = h
         self.h.tstop = tstop
         self.stim_amp = stim_amp
         self.stim_delay = stim_delay
         self.stim_dur = stim_dur
+        self.early_stop = early_stop
+        self.dvdt_tol = dvdt_tol
+        self.chunk_dur = chunk_dur
+        self.settled_chunks = settled_chunks
+        self.settled_time = None  # time the early-stop run ended (ms), None if it ran to completion
+        self.rest_state_cache = rest_state_cache
+        self.rest_state_key = rest_state_key
+        self.plot = plot
         self.stim = None      # will hold the IClamp object
-        self.t_vec = None     # time recorder
+        self.t_vec = None     # time recorder (variable time step only; see time())
         self.v_vec = None     # voltage recorder
+        self.imp = None       # will hold the Impedance object
+
+    def protocol(self, method="transient"):
+        """
+        Protocol parameters that determine the measurement (used for result cache keys).
+
+        Parameters:
+          method : the measure_r_in method the result comes from
+        """
+        rest_state = None
+        if self.rest_state_cache is not None:
+            rest_state = {"v_init": self.rest_state_cache.v_init, "settle_time": self.rest_state_cache.settle_time}
+        return {"protocol": "r_in", "method": method, "stim_amp": self.stim_amp, "stim_delay": self.stim_delay,
+                "stim_dur": self.stim_dur, "tstop": self.h.tstop, "dt": self.h.dt,
+                "early_stop": self.early_stop,
+                "dvdt_tol": self.dvdt_tol if self.early_stop else None,
+                "chunk_dur": self.chunk_dur if self.early_stop else None,
+                "settled_chunks": self.settled_chunks if self.early_stop else None,
+                "rest_state": rest_state}
 
     def setup_stimulation(self):
         """Set up the IClamp at the midpoint of the soma."""
@@ -31,32 +73,118 @@ class RInSimulation:
         self.stim.dur = self.stim_dur
 
     def setup_recording(self):
-        """Set up vectors to record time and somatic voltage."""
-        self.t_vec = self.h.Vector()
-        self.v_vec = self.h.Vector()
-        self.t_vec.record(self.h._ref_t)
-        self.v_vec.record(self.h.soma[0](0.5)._ref_v)
+        """
+        Set up the somatic voltage recorder, plus a time recorder if CVode is active.
+
+        The vectors are created once and refilled by every run. With a fixed time step the
+        samples are dt apart, so time is not recorded (see time()).
+        """
+        if self.v_vec is None:
+            self.v_vec = self.h.Vector()
+            self.v_vec.record(self.h.soma[0](0.5)._ref_v)
+        if self.t_vec is None and self.h.cvode.active():
+            self.t_vec = self.h.Vector()
+            self.t_vec.record(self.h._ref_t)
+
+    def voltage(self):
+        """
+        Somatic voltage of the last run (mV) as a NumPy view of v_vec, without copying.
+
+        The view shares v_vec's memory, so it is only valid until the next run resizes the
+        vector. Copy it (np.array) to keep a trace across runs.
+        """
+        return self.v_vec.as_numpy()
+
+    def time(self):
+        """Sample times of voltage() (ms): the recorded times under CVode, computed from h.dt otherwise."""
+        if self.t_vec is not None:
+            return self.t_vec.as_numpy()
+        # both run paths start recording at t = 0
+        return fixed_step_time(len(self.v_vec), self.h.dt)
 
     def run_simulation(self):
         """Initialize and run the simulation."""
+        if self.rest_state_cache is not None:
+            # drop the previous IClamp so it cannot disturb a newly created resting state
+            self.stim = None
+            self.rest_state_cache.restore(self.h, self.rest_state_key)
+            self.setup_stimulation()
+            self.setup_recording()
+            self.h.frecord_init()
+            if self.early_stop:
+                self.run_until_settled()
+            else:
+                self.h.continuerun(self.h.tstop)
+            return
+
         self.setup_stimulation()
         self.setup_recording()
         # You may need to adjust the initial voltage (here, set to -65 mV)
         self.h.finitialize(-65)
-        self.h.run()
+        if self.early_stop:
+            # same initialization h.run() performs
+            self.h.stdinit()
+            self.run_until_settled()
+        else:
+            self.h.run()
+
+    def run_until_settled(self):
+        """
+        Advance the simulation in chunks and stop once the soma reaches steady state.
+
+        The pre-stimulus period is always simulated so V_rest is available. During the
+        stimulus the simulation advances chunk_dur ms at a time and stops after
+        settled_chunks consecutive chunks with |dV/dt| < dvdt_tol, or at the end of the
+        stimulus if the voltage never settles. self.settled_time is set when it stops early.
+        The simulation must already be initialized.
+        """
+        self.settled_time = None
+        stim_end = self.stim_delay + self.stim_dur
+
+        self.h.continuerun(self.stim_delay)
+        v_prev = self.h.soma[0](0.5).v
+        t_prev = self.h.t
+        n_settled = 0
+        while self.h.t < stim_end:
+            self.h.continuerun(min(self.h.t + self.chunk_dur, stim_end))
+            v_now = self.h.soma[0](0.5).v
+            # the last chunk can be shorter than chunk_dur, so use the time actually advanced
+            dvdt = abs(v_now - v_prev) / (self.h.t - t_prev)
+            v_prev, t_prev = v_now, self.h.t
+            n_settled = n_settled + 1 if dvdt < self.dvdt_tol else 0
+            if n_settled >= self.settled_chunks:
+                self.settled_time = self.h.t
+                print(f"settled at [ {self.settled_time:.4} ] ms (|dV/dt| {dvdt:.3} mV/ms)")
+                break
 
     def plot_voltage(self):
         """Plot the recorded voltage trace."""
-        t = np.array(self.t_vec)
-        v = np.array(self.v_vec)
+        # imported here so headless runs (plot=False) never load matplotlib
+        import matplotlib.pyplot as plt
         plt.figure()
-        plt.plot(t, v)
+        plt.plot(self.time(), self.voltage())
         plt.xlabel("Time (ms)")
         plt.ylabel("Voltage (mV)")
         plt.title("Voltage Trace")
         plt.savefig("voltage_trace_Rin.png")
+        plt.close()
 
-    def measure_r_in(self):
+    def measure_r_in(self, method="transient"):
+        """
+        Calculate the input resistance with the requested method.
+
+        Parameters:
+          method : "transient" runs the full current step (see measure_r_in_transient),
+                   "impedance" uses a single linearized solve (see measure_r_in_impedance)
+        """
+        if method == "transient":
+            return self.measure_r_in_transient()
+        elif method == "impedance":
+            return self.measure_r_in_impedance()
+        else:
+            raise ValueError(f"Unknown R_in method: {method}")
+
+    def measure_r_in_transient(self):
         """
         Run the simulation, plot the voltage trace, and calculate the input resistance.
         
@@ -67,9 +195,9 @@ class RInSimulation:
           - V_trough is the minimum voltage during the stimulus.
         """
         self.run_simulation()
-        self.plot_voltage()
-        t = np.array(self.t_vec)
-        v = np.array(self.v_vec)
+        if self.plot:
+            self.plot_voltage()
+        v = self.voltage()
         dt = self.h.dt
 
         # Determine the indices corresponding to the start and end of the stimulus
@@ -79,6 +207,9 @@ class RInSimulation:
         # determine indices to use for V_rest and V_trough
         V_rest_idx = stim_start_idx - 1
         V_trough_idx = stim_end_idx - 1
+        if self.settled_time is not None:
+            # the run stopped early; the settled value stands in for the end of the stimulus
+            V_trough_idx = len(v) - 1
 
         # find the voltages
         V_rest = v[V_rest_idx]
@@ -96,3 +227,276 @@ class RInSimulation:
         print(f"r_in = [ {V_rest:.3} - {V_trough:.3} ] mV / [ 0 - {self.stim_amp:.3} ] nA  = {r_in:.3} MOhm")
       
         return r_in
+
+    def measure_r_in_impedance(self, v_init=-65, settle_time=None):
+        """
+        Calculate the zero-frequency input resistance at soma[0](0.5) with NEURON's Impedance class.
+
+        The cell is initialized and allowed to settle without stimulation, then the
+        membrane is linearized around that state (including the gating variables of
+        active channels) and solved once at 0 Hz. This is the small-signal input
+        resistance; it can differ from the transient estimate when Ih or other active
+        conductances make the response to stim_amp nonlinear (see compare_r_in_methods).
+
+        Parameters:
+          v_init      : initial voltage (mV)
+          settle_time : time to simulate before linearizing (ms). Defaults to stim_delay,
+                        the point where the transient method reads V_rest. Not used when
+                        a rest_state_cache is set; the cached resting state is used instead.
+        """
+        if settle_time is None:
+            settle_time = self.stim_delay
+
+        if self.rest_state_cache is not None:
+            # drop the previous IClamp so it cannot disturb a newly created resting state
+            self.stim = None
+            self.rest_state_cache.restore(self.h, self.rest_state_key)
+        else:
+            self.h.finitialize(v_init)
+            if settle_time > 0:
+                self.h.continuerun(settle_time)
+
+        self.imp = self.h.Impedance()
+        self.imp.loc(0.5, sec=self.h.soma[0])
+        self.imp.compute(0, 1) # 0 Hz, include the linearized channel gating
+
+        # input() is already in MOhm
+        r_in = self.imp.input(0.5, sec=self.h.soma[0])
+        print(f"V_rest [ {self.h.soma[0](0.5).v:.3} ] mV at [ {self.h.t:.3} ] ms")
+        print(f"r_in (impedance, 0 Hz) = {r_in:.3} MOhm")
+
+        return r_in
+
+    def transfer_resistance(self, seg):
+        """
+        Return the zero-frequency transfer resistance (MOhm) between soma[0](0.5) and seg.
+
+        Uses the solve from the most recent measure_r_in_impedance call.
+        """
+        if self.imp is None:
+            raise RuntimeError("Call measure_r_in_impedance before transfer_resistance.")
+        return self.imp.transfer(seg.x, sec=seg.sec)
+
+    def compare_r_in_methods(self):
+        """
+        Measure R_in with both methods and report how far the impedance estimate is from the transient one.
+
+        Returns:
+          dict with the transient and impedance R_in (MOhm) and the percent difference
+          of the impedance estimate relative to the transient estimate.
+        """
+        r_in_transient = self.measure_r_in_transient()
+        r_in_impedance = self.measure_r_in_impedance()
+        percent_difference = ((r_in_impedance - r_in_transient) / r_in_transient) * 100
+
+        print(f"r_in transient {r_in_transient:.5} MOhm, impedance {r_in_impedance:.5} MOhm, difference {percent_difference:.3}%")
+
+        return {"transient": r_in_transient,
+                "impedance": r_in_impedance,
+                "percent_difference": percent_difference}
+
+def detect_voltage_events(t, v, threshold=-20.0):
+    """
+    Find the times at which the voltage peaks above threshold.
+
+    An event is a sample above threshold where the slope changes from positive to negative.
+
+    Parameters:
+      t        : NumPy array of time points (ms)
+      v        : NumPy array of voltage values (mV)
+      threshold: voltage the peak must exceed (mV)
+
+    Returns:
+      NumPy array of event times (ms)
+    """
+    # Calculate the slope of the voltage
+    slope = np.diff(v)
+
+    # Find the indices where the voltage is above threshold
+    above_threshold_indices = np.where(v[:-1] > threshold)[0]
+
+    # Find the indices where the slope changes from positive to negative
+    positive_to_negative_indices = np.where((slope[:-1] > 0) & (slope[1:] < 0))[0]
+
+    # Find the intersection of the two sets of indices
+    event_indices = np.intersect1d(above_threshold_indices, positive_to_negative_indices)
+
+    # the peak sample is one past the last rising difference
+    return t[event_indices + 1]
+
+class FISimulation:
+    def __init__(self, h, stim_delay=300.0, stim_dur=400.0, tstop=1000.0, dt=0.1, spike_threshold=-20.0,
+                 record_traces=False):
+        """
+        Initialize a current-step protocol for building FI curves.
+
+        Spikes are detected during the run by a NetCon watching the somatic voltage, so
+        only the spike times are stored. Dense time and voltage traces are recorded only
+        when record_traces is True.
+
+        Parameters:
+          h              : the NEURON h object holding the cell (expected to have a 'soma' section)
+          stim_delay     : delay before the stimulus begins (ms)
+          stim_dur       : duration of the stimulus (ms)
+          tstop          : simulation end time (ms)
+          dt             : simulation time step (ms)
+          spike_threshold: upward voltage crossing that counts as a spike (mV)
+          record_traces  : also record v_vec (and t_vec if CVode is active; see time())
+        """
+        self.h = h
+        self.stim_delay = stim_delay
+        self.stim_dur = stim_dur
+        self.tstop = tstop
+        self.dt = dt
+        self.spike_threshold = spike_threshold
+        self.record_traces = record_traces
+        self.stim = None      # will hold the IClamp object
+        self.spike_detector = None  # NetCon on the somatic voltage
+        self.spike_vec = None # spike time recorder
+        self.abort_detector = None  # NetCon that stops the run at the first spike (fires only)
+        self.first_spike = None     # time of the first spike in the last fires() trial (ms)
+        self.t_vec = None     # time recorder (record_traces with CVode only)
+        self.v_vec = None     # voltage recorder (record_traces only)
+
+    def protocol(self, amplitudes=None):
+        """
+        Protocol parameters that determine the result (used for result cache keys).
+
+        Parameters:
+          amplitudes : the step amplitudes (nA) the result covers
+        """
+        return {"protocol": "fi", "stim_delay": self.stim_delay, "stim_dur": self.stim_dur,
+                "tstop": self.tstop, "dt": self.dt, "spike_threshold": self.spike_threshold,
+                "amplitudes": None if amplitudes is None else [float(amp) for amp in amplitudes]}
+
+    def setup_stimulation(self):
+        """Set up the IClamp at the midpoint of the soma."""
+        self.stim = self.h.IClamp(self.h.soma[0](0.5))
+        self.stim.delay = self.stim_delay
+        self.stim.dur = self.stim_dur
+
+    def setup_recording(self):
+        """Set up spike detection, plus a somatic voltage recorder if record_traces is set."""
+        soma = self.h.soma[0]
+        self.spike_detector = self.h.NetCon(soma(0.5)._ref_v, None, sec=soma)
+        self.spike_detector.threshold = self.spike_threshold
+        self.spike_vec = self.h.Vector()
+        self.spike_detector.record(self.spike_vec)
+
+        if self.record_traces:
+            self.v_vec = self.h.Vector()
+            self.v_vec.record(soma(0.5)._ref_v)
+            if self.h.cvode.active():
+                self.t_vec = self.h.Vector()
+                self.t_vec.record(self.h._ref_t)
+
+    def voltage(self):
+        """
+        Somatic voltage of the last run (mV) as a NumPy view of v_vec (record_traces only).
+
+        The view is only valid until the next run; copy it (np.array) to keep it.
+        """
+        return self.v_vec.as_numpy()
+
+    def time(self):
+        """Sample times of voltage() (ms): the recorded times under CVode, computed from dt otherwise."""
+        if self.t_vec is not None:
+            return self.t_vec.as_numpy()
+        return fixed_step_time(len(self.v_vec), self.dt)
+
+    def run_amplitude(self, amp):
+        """
+        Simulate one current step and return the spike times (ms).
+
+        Parameters:
+          amp : amplitude of the injected current (nA)
+        """
+        if self.stim is None:
+            self.setup_stimulation()
+            self.setup_recording()
+        self.stim.amp = amp
+        self.h.tstop = self.tstop
+        self.h.dt = self.dt
+        self.h.steps_per_ms = 1 / self.dt
+
+        if self.abort_detector is not None:
+            self.abort_detector.active(False)
+
+        self.spike_vec.resize(0)
+        self.h.finitialize()
+        self.h.run()
+
+        # a copy, since spike_vec is refilled by the next run
+        return np.array(self.spike_vec)
+
+    def _stop_at_first_spike(self):
+        """NetCon callback: stop the run at the first spike inside the stimulus window."""
+        if self.first_spike is None and self.h.t >= self.stim_delay:
+            self.first_spike = self.h.t
+            self.h.stoprun = 1
+
+    def fires(self, amp):
+        """
+        Return True if a step of amp (nA) makes the cell spike during the stimulus.
+
+        The run stops at the first spike (NetCon event with h.stoprun) or at the end of
+        the stimulus window, so most trials end long before tstop.
+        """
+        if self.stim is None:
+            self.setup_stimulation()
+            self.setup_recording()
+        if self.abort_detector is None:
+            soma = self.h.soma[0]
+            self.abort_detector = self.h.NetCon(soma(0.5)._ref_v, None, sec=soma)
+            self.abort_detector.threshold = self.spike_threshold
+            self.abort_detector.record(self._stop_at_first_spike)
+        self.abort_detector.active(True)
+
+        self.stim.amp = amp
+        self.h.tstop = self.tstop
+        self.h.dt = self.dt
+        self.h.steps_per_ms = 1 / self.dt
+
+        self.first_spike = None
+        self.h.stdinit()
+        self.h.continuerun(self.stim_delay + self.stim_dur)
+        return self.first_spike is not None
+
+    def find_rheobase(self, amp_low=0.0, amp_high=0.5, tol=0.001, max_trials=25):
+        """
+        Find the rheobase by bisection over the step amplitude.
+
+        Parameters:
+          amp_low   : amplitude expected not to fire (nA)
+          amp_high  : amplitude expected to fire (nA)
+          tol       : stop when the bracket is narrower than this (nA)
+          max_trials: maximum number of simulated steps
+
+        Returns:
+          the lowest amplitude found to fire (nA), or None if amp_high does not fire
+        """
+        trials = 1
+        if not self.fires(amp_high):
+            print(f"no spike at [ {amp_high:.4} ] nA; rheobase is above the search range")
+            return None
+        trials += 1
+        if self.fires(amp_low):
+            print(f"spike at [ {amp_low:.4} ] nA; rheobase is at or below the search range")
+            return amp_low
+
+        while amp_high - amp_low > tol and trials < max_trials:
+            amp = 0.5 * (amp_low + amp_high)
+            trials += 1
+            if self.fires(amp):
+                amp_high = amp
+            else:
+                amp_low = amp
+
+        print(f"rheobase [ {amp_high * 1000:.4} ] pA (bracket {amp_low * 1000:.4} - {amp_high * 1000:.4} pA, {trials} trials)")
+        return amp_high
+
+    def firing_rate(self, spike_times):
+        """Firing rate (Hz) over the stimulus window."""
+        stim_end = self.stim_delay + self.stim_dur
+        n_spikes = np.count_nonzero((spike_times >= self.stim_delay) & (spike_times < stim_end))
+        return n_spikes / (self.stim_dur / 1000)
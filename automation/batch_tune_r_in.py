@@ -0,0 +1,181 @@
+# Runs download_from_allen_and_tune_r_in for a cohort of cells and writes one JSON record per cell.
+#
+# example use:
+#   python -m automation.batch_tune_r_in cells.csv --user-specs user_specifications.json --workers 8
+#   python -m automation.batch_tune_r_in 488683425 "http://celltypes.brain-map.org/experiment/electrophysiology/488697163"
+#
+# Cells can be given as ids or cell types URLs on the command line, in a text file (one per line)
+# or in a CSV file. A CSV uses its specimen_id column (or its first column); non-empty columns named
+# after a numeric user specification (see SPEC_COLUMNS, e.g. R-in) override it for that cell. Other
+# columns (notes, cell type, ...) are ignored. A row with a value that is not a number in one of the
+# specification columns is reported and skipped; the rest of the file is still read. The same goes
+# for rows, lines and arguments without a specimen id, and for empty CSV files.
+#
+# Each cell runs in its own directory (<work-dir>/<specimen_id>) and in a fresh process, since the
+# Allen cell is built into NEURON's top level. Its printed output goes to tune_r_in.log there.
+# Records are appended to the output file as cells finish; with --resume, cells that already have a
+# record without an error are skipped.
+
+import argparse
+import contextlib
+import csv
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+from automation.download_from_allen_and_tune_r_in import load_dictionary_from_json, robust_int_conversion
+
+# user specifications a CSV column can override, with the type their values are read as
+SPEC_COLUMNS = {"R-in": float, "R-in tolerance": float, "max evaluations": int, "e_pas": float, "ra": float}
+
+def _spec_overrides(row, line):
+    """Numeric specification overrides of one CSV row. Returns None (after reporting why) if one does not parse."""
+    overrides = {}
+    for key, convert in SPEC_COLUMNS.items():
+        value = (row.get(key) or "").strip()
+        if not value:
+            continue
+        try:
+            overrides[key] = convert(value)
+        except ValueError:
+            print(f"{line}: skipping cell, {key} value {value!r} is not a number")
+            return None
+    return overrides
+
+def _specimen_id(value, where):
+    """Specimen id from an id or cell types URL. Returns None (after reporting why) if it has none."""
+    try:
+        return robust_int_conversion(value)
+    except (ValueError, TypeError) as e:
+        print(f"{where}: skipping cell, {e}")
+        return None
+
+def read_cells(entries):
+    """
+    Resolve command line entries to a list of (specimen_id, spec_overrides).
+
+    Each entry is a specimen id, a cell types URL, a text file with one of those per line or a
+    CSV file (see module comment). Duplicate specimen ids keep their first occurrence. Entries,
+    lines and rows without a usable specimen id are reported and skipped.
+    """
+    cells = {}
+    for entry in entries:
+        if entry.endswith(".csv") and os.path.exists(entry):
+            with open(entry, newline="") as file:
+                reader = csv.DictReader(file)
+                if reader.fieldnames is None:
+                    print(f"{entry}: skipping empty CSV file")
+                    continue
+                id_column = "specimen_id" if "specimen_id" in reader.fieldnames else reader.fieldnames[0]
+                for row in reader:
+                    if not row[id_column]:
+                        continue
+                    where = f"{entry} line {reader.line_num}"
+                    specimen_id = _specimen_id(row[id_column], where)
+                    overrides = _spec_overrides(row, where) if specimen_id is not None else None
+                    if overrides is not None:
+                        cells.setdefault(specimen_id, overrides)
+        elif os.path.isfile(entry):
+            with open(entry) as file:
+                for line_num, line in enumerate(file, 1):
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        specimen_id = _specimen_id(line, f"{entry} line {line_num}")
+                        if specimen_id is not None:
+                            cells.setdefault(specimen_id, {})
+        else:
+            specimen_id = _specimen_id(entry, entry)
+            if specimen_id is not None:
+                cells.setdefault(specimen_id, {})
+    return list(cells.items())
+
+def completed_cells(output_path):
+    """Specimen ids that already have a successful record in output_path."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                if "error" not in record:
+                    done.add(record["specimen_id"])
+    return done
+
+def _tune_cell(task):
+    """Tune one cell in its working directory. Runs in a worker process; never raises."""
+    specimen_id, user_specs_dict, work_dir, plot = task
+    # imported here so the parent process does not load NEURON through the tuning script
+    from automation.download_from_allen_and_tune_r_in import tune_r_in
+
+    cell_dir = os.path.join(work_dir, str(specimen_id))
+    os.makedirs(cell_dir, exist_ok=True)
+    os.chdir(cell_dir)
+
+    start = time.perf_counter()
+    with open("tune_r_in.log", "w") as log, contextlib.redirect_stdout(log):
+        try:
+            record = tune_r_in(specimen_id, user_specs_dict, plot=plot)
+        except Exception as e:
+            traceback.print_exc(file=log)
+            record = {"specimen_id": specimen_id, "error": f"{type(e).__name__}: {e}"}
+    record["work_dir"] = cell_dir
+    record["total_time"] = time.perf_counter() - start
+    return record
+
+def run_batch(cells, user_specs_dict, output_path, work_dir="cells", n_workers=None, plot=False):
+    """
+    Tune every cell with at most n_workers running at once, appending a JSON line per cell to
+    output_path as it finishes. Returns the records in completion order.
+    """
+    work_dir = os.path.abspath(work_dir)
+    tasks = [(specimen_id, dict(user_specs_dict or {}, **overrides), work_dir, plot)
+             for specimen_id, overrides in cells]
+    n_workers = min(n_workers or os.cpu_count(), len(tasks)) or 1
+
+    records = []
+    # spawn and one task per child: every cell gets a clean NEURON instance
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=n_workers, maxtasksperchild=1) as pool, open(output_path, "a") as output:
+        for record in pool.imap_unordered(_tune_cell, tasks):
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            records.append(record)
+            if "error" in record:
+                print(f"cell {record['specimen_id']} failed: {record['error']}")
+            else:
+                print(f"cell {record['specimen_id']}: R_in {record['original_r_in']:.5} -> {record['new_r_in']:.5} MOhm "
+                      f"in {record['total_time']:.1f} s ({len(records)}/{len(tasks)})")
+    return records
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download and tune soma g_pas to a target R_in for many cells.")
+    parser.add_argument("cells", nargs="+", help="specimen ids, cell types URLs, or .txt/.csv files listing them")
+    parser.add_argument("--user-specs", help="JSON file with user specifications shared by all cells")
+    parser.add_argument("--output", default="tune_r_in_results.jsonl", help="JSON Lines file the records are appended to")
+    parser.add_argument("--work-dir", default="cells", help="directory holding one working directory per cell")
+    parser.add_argument("--workers", type=int, default=None, help="cells tuned at once (defaults to the CPU count)")
+    parser.add_argument("--plot", action="store_true", help="save voltage trace plots in each cell directory")
+    parser.add_argument("--resume", action="store_true", help="skip cells that already have a successful record")
+    args = parser.parse_args(argv)
+
+    cells = read_cells(args.cells)
+    if args.resume:
+        done = completed_cells(args.output)
+        cells = [(specimen_id, overrides) for specimen_id, overrides in cells if specimen_id not in done]
+        print(f"skipping {len(done)} completed cells")
+    if not cells:
+        print("no cells to tune")
+        return []
+
+    user_specs_dict = load_dictionary_from_json(args.user_specs) if args.user_specs else None
+    print(f"tuning {len(cells)} cells")
+    records = run_batch(cells, user_specs_dict, args.output, args.work_dir, args.workers, args.plot)
+    failed = sum("error" in record for record in records)
+    print(f"done: {len(records) - failed} tuned, {failed} failed. records in {args.output}")
+    return records
+
+if __name__ == "__main__":
+    main()
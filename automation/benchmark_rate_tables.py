@@ -0,0 +1,55 @@
+# Benchmarks table-driven channel kinetics against the analytic rates.
+#
+# example use (from the directory holding manifest.json):
+#   python -m automation.rate_tables modfiles modfiles_tabulated --resolution 200
+#   nrnivmodl modfiles_tabulated
+#   python -m automation.benchmark_rate_tables manifest.json
+#
+# The same compiled (tabulated) mechanisms are run twice: once with every usetable_<suffix>
+# flag off (analytic rates) and once with them on. Reports the run time of each mode, the
+# speedup and the maximum somatic voltage deviation for every amplitude.
+
+import sys
+import time
+
+import numpy as np
+
+from automation.cell_builder import build_cell
+from automation.rate_tables import set_rate_tables
+from automation.Simulation import FISimulation
+
+def run_mode(sim, amps, use_tables, repeats):
+    """Simulate every amplitude repeats times. Returns the best total time (s) and the traces."""
+    set_rate_tables(sim.h, use_tables)
+    best = None
+    for _ in range(repeats):
+        traces = []
+        start = time.perf_counter()
+        for amp in amps:
+            sim.run_amplitude(amp)
+            traces.append(np.array(sim.v_vec))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, np.array(traces)
+
+if __name__ == "__main__":
+    manifest_path = sys.argv[1] if len(sys.argv) > 1 else "manifest.json"
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    amps = [-0.1, 0.0, 0.1, 0.2, 0.3]
+
+    utils = build_cell(manifest_path)
+    h = utils.h
+    sim = FISimulation(h, record_traces=True)
+
+    tabulated = set_rate_tables(h, True)
+    if not tabulated:
+        raise SystemExit("No tabulated mechanisms are loaded; compile the output of automation.rate_tables first.")
+    print(f"tabulated mechanisms: {', '.join(tabulated)} (celsius {h.celsius})")
+
+    analytic_time, analytic_traces = run_mode(sim, amps, False, repeats)
+    table_time, table_traces = run_mode(sim, amps, True, repeats)
+
+    print(f"analytic {analytic_time:.3f} s, tables {table_time:.3f} s, speedup {analytic_time / table_time:.2f}x")
+    for amp, analytic_v, table_v in zip(amps, analytic_traces, table_traces):
+        max_dv = np.max(np.abs(analytic_v - table_v))
+        print(f"amp [ {amp:.3} ] nA  max |dV| = {max_dv:.3e} mV")
@@ -0,0 +1,69 @@
+# Measures the per-run allocations of reading R_in traces: recorded time and copies vs views.
+#
+# example use (from the directory holding manifest.json):
+#   python -m automation.benchmark_recording manifest.json 5
+#
+# "copies" reproduces the earlier recording layer: t recorded every step, and np.array copies of
+# t and v made by measure_r_in_transient and again by plot_voltage. "views" is the current one:
+# no t recorder under a fixed time step and as_numpy() views of v. NumPy allocations are measured
+# with tracemalloc. NEURON allocates vector storage itself, outside tracemalloc, so the recorder
+# memory is reported separately from the vector sizes.
+
+import sys
+import tracemalloc
+
+import numpy as np
+
+from automation.cell_builder import build_cell
+from automation.Simulation import RInSimulation
+
+def read_copies(sim):
+    """Trace reads of one R_in measurement with plotting, as the copying recording layer did them."""
+    traces = []
+    for _ in range(2):  # plot_voltage, then measure_r_in_transient
+        traces.append((np.array(sim.t_vec), np.array(sim.v_vec)))
+    return traces
+
+def read_views(sim):
+    """The same reads with views; time is computed once for the plot."""
+    return [(sim.time(), sim.voltage()), (None, sim.voltage())]
+
+def measure(h, mode, repeats):
+    """Run the R_in protocol repeats times. Returns (mean NumPy bytes allocated per run, recorder bytes)."""
+    sim = RInSimulation(h, plot=False)
+    if mode == "copies":
+        sim.t_vec = h.Vector()
+        sim.t_vec.record(h._ref_t)
+    read = read_copies if mode == "copies" else read_views
+
+    allocated = []
+    for _ in range(repeats):
+        sim.run_simulation()
+        tracemalloc.start()
+        traces = read(sim)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        allocated.append(peak)
+        del traces
+
+    recorder_bytes = sum(vec.size() * 8 for vec in [sim.t_vec, sim.v_vec] if vec is not None)
+    # release the IClamp and recorders so they do not affect the next mode
+    sim.stim = None
+    sim.t_vec = sim.v_vec = None
+    return np.mean(allocated), recorder_bytes
+
+if __name__ == "__main__":
+    manifest_path = sys.argv[1] if len(sys.argv) > 1 else "manifest.json"
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    utils = build_cell(manifest_path)
+    h = utils.h
+    if h.cvode.active():
+        raise SystemExit("CVode is active; time is only implicit with a fixed time step.")
+
+    results = {mode: measure(h, mode, repeats) for mode in ["copies", "views"]}
+    for mode, (allocated, recorder_bytes) in results.items():
+        print(f"{mode:7} NumPy allocations per run {allocated / 1024:9.1f} KiB, NEURON recorders {recorder_bytes / 1024:9.1f} KiB")
+    before = sum(results["copies"])
+    after = sum(results["views"])
+    print(f"total per run {before / 1024:.1f} KiB -> {after / 1024:.1f} KiB ({(1 - after / before) * 100:.0f}% less)")
@@ -0,0 +1,53 @@
+# Measures the startup time of the tuning CLI against a budget.
+#
+# example use:
+#   python -m automation.benchmark_startup
+#   python -m automation.benchmark_startup --budget 0.5 --repeats 10
+#
+# Each command is run in a fresh interpreter (as a job array would) and the best of the repeats
+# is compared to the budget. Exits nonzero when a command is over budget, so it can gate CI or a
+# job submission script. Use python -X importtime to see which imports take the time.
+
+import argparse
+import subprocess
+import sys
+import time
+
+COMMANDS = {
+    "import": [sys.executable, "-c", "import automation.download_from_allen_and_tune_r_in"],
+    "--help": [sys.executable, "-m", "automation.download_from_allen_and_tune_r_in", "--help"],
+}
+
+def time_command(cmd, repeats):
+    """Run cmd repeats times. Returns the best wall time (s)."""
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def baseline(repeats):
+    """Best wall time of a bare interpreter, subtracted to report the CLI's own cost."""
+    return time_command([sys.executable, "-c", "pass"], repeats)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the startup of the tuning CLI.")
+    parser.add_argument("--budget", type=float, default=1.0, help="allowed startup time in seconds")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    interpreter_time = baseline(args.repeats)
+    print(f"bare interpreter {interpreter_time:.3f} s")
+
+    over_budget = []
+    for name, cmd in COMMANDS.items():
+        elapsed = time_command(cmd, args.repeats)
+        status = "ok" if elapsed <= args.budget else "OVER BUDGET"
+        print(f"{name:8} {elapsed:.3f} s (+{elapsed - interpreter_time:.3f} s over bare interpreter) [ {status} ]")
+        if elapsed > args.budget:
+            over_budget.append(name)
+
+    if over_budget:
+        raise SystemExit(f"startup over the {args.budget} s budget: {', '.join(over_budget)}")
@@ -0,0 +1,88 @@
+from automation.compile_cache import load_mechanisms
+
+def section_type(sec):
+  """'soma', 'dend', 'apic' or 'axon' from a section name like soma[0] or AllenPopulationCell[3].dend[12]."""
+  return sec.name().split(".")[-1].split("[")[0]
+
+def update_missing_passive_values(utils, user_specs_dict):
+  # update missing properties to user_specs_dict if they're not already in the allen specifications
+  if "e_pas" not in utils.description.data["passive"][0].keys():
+    utils.description.data["passive"][0]["e_pas"] = user_specs_dict["e_pas"]
+  
+  if "cm" not in utils.description.data["passive"][0].keys():
+    utils.description.data["passive"][0]["cm"] = user_specs_dict["cm"]
+  
+  if "ra" not in utils.description.data["passive"][0].keys():
+    utils.description.data["passive"][0]["ra"] = user_specs_dict["ra"]
+
+  return utils
+
+def apply_genome_overrides(genome, overrides):
+  """Set genome values from a list of {"section", "name", "value"} dicts.
+
+  Args:
+    genome: the fit's genome list (utils.description.data["genome"]).
+    overrides: entries to assign. "all" matches every section.
+
+  Raises:
+    ValueError: If an override does not match any genome entry.
+  """
+  for override in overrides:
+    matched = False
+    for entry in genome:
+      if override["section"] in (entry["section"], "all") and entry["name"] == override["name"]:
+        entry["value"] = float(override["value"])
+        matched = True
+    if not matched:
+      raise ValueError(f"No genome entry for {override['section']} {override['name']}")
+  return genome
+
+def build_cell(manifest_path="manifest.json", user_specs_dict=None, genome_overrides=None, soma_diam_scale=1.0,
+               modfile_dir=None):
+  """Build the Allen cell described by a manifest into NEURON's top level.
+
+  Args:
+    manifest_path: path to the manifest.json written by BiophysicalApi.cache_data.
+    user_specs_dict: optional user specifications used to fill missing passive values.
+    genome_overrides: optional list of {"section", "name", "value"} genome changes.
+    soma_diam_scale: factor applied to soma[0].diam after the cell is built.
+    modfile_dir: optional modfile directory to load through the compile cache. If None,
+      the mechanisms NEURON loaded from the working directory are used.
+
+  Returns:
+    The allensdk Utils object. The cell's sections are on utils.h.
+  """
+  # imported here so that importing this module does not load allensdk or NEURON
+  from allensdk.model.biophys_sim.config import Config
+  from allensdk.model.biophysical.utils import Utils
+
+  if modfile_dir is not None:
+    from neuron import h
+    load_mechanisms(h, modfile_dir)
+
+  # Create the h object
+  description = Config().load(manifest_path)
+  utils = Utils(description)
+  h = utils.h
+
+  # convert 'values' from string to float
+  for entry in utils.description.data['genome']:
+    entry['value'] = float(entry['value'])
+
+  if user_specs_dict:
+    utils = update_missing_passive_values(utils, user_specs_dict)
+
+  if genome_overrides:
+    apply_genome_overrides(utils.description.data['genome'], genome_overrides)
+
+  # read morphology
+  morphology_path = description.manifest.get_path('MORPHOLOGY')
+  utils.generate_morphology(morphology_path.encode('ascii', 'ignore'))
+
+  # build the cell. Its parts will be assigned to the h object
+  utils.load_cell_parameters()
+
+  if soma_diam_scale != 1.0:
+    h.soma[0].diam = h.soma[0].diam * soma_diam_scale
+
+  return utils
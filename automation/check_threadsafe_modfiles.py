@@ -0,0 +1,98 @@
+# Checks that THREADSAFE modfiles reproduce the traces of the original modfiles.
+#
+# example use (from the repository root, with the cell's manifest.json in automation/):
+#   mkdir -p /tmp/original && git archive <commit before THREADSAFE was added> "allen modfiles" | tar -x -C /tmp/original
+#   python -m automation.check_threadsafe_modfiles "/tmp/original/allen modfiles" "allen modfiles" --manifest automation/manifest.json --nthread 4
+#
+# Each modfile set is compiled in a temporary directory and simulated in its own
+# process (NEURON cannot load two mechanism sets with the same names). The original
+# set runs one copy of the cell single-threaded as the reference. The THREADSAFE set
+# runs a CellPopulation of several copies with ParallelContext.nthread(n): NEURON
+# assigns whole cells to threads, so the copies are what gets simulated concurrently.
+# Every copy's somatic trace is compared against the reference.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def compile_modfiles(modfile_dir, build_dir):
+    """Copy the .mod files into build_dir/modfiles and compile them there."""
+    target = os.path.join(build_dir, "modfiles")
+    os.makedirs(target)
+    for name in os.listdir(modfile_dir):
+        if name.endswith(".mod"):
+            shutil.copy(os.path.join(modfile_dir, name), target)
+    subprocess.run(["nrnivmodl", "modfiles"], cwd=build_dir, check=True, stdout=subprocess.DEVNULL)
+
+def simulate(build_dir, manifest_path, nthread, copies, amps, out_path):
+    """Run the worker in build_dir so NEURON loads that directory's compiled mechanisms."""
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    subprocess.run([sys.executable, "-m", "automation.check_threadsafe_modfiles", "--worker",
+                    manifest_path, str(nthread), str(copies), out_path] + [str(amp) for amp in amps],
+                   cwd=build_dir, env=env, check=True)
+
+def worker(manifest_path, nthread, copies, out_path, amps, delay=300.0, dur=400.0, tstop=1000.0):
+    """
+    Build copies of the cell, run one current step per amplitude with nthread threads and
+    save the somatic traces as an array of shape (amplitudes, copies, samples).
+    """
+    # importing neuron here loads the mechanisms compiled in the current directory
+    from automation.cell_builder import build_cell
+    from automation.population import CellPopulation
+
+    out_path = os.path.abspath(out_path)
+    os.chdir(os.path.dirname(os.path.abspath(manifest_path)))
+    utils = build_cell(os.path.basename(manifest_path))
+    population = CellPopulation(utils, [[] for _ in range(copies)], nthread)
+
+    traces = []
+    for amp in amps:
+        _, v = population.run(amp, delay, dur, tstop)
+        traces.append(v)
+    np.save(out_path, np.array(traces))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        worker(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), sys.argv[5], [float(amp) for amp in sys.argv[6:]])
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description="Compare THREADSAFE modfiles against the originals.")
+    parser.add_argument("original_dir")
+    parser.add_argument("threadsafe_dir")
+    parser.add_argument("--manifest", default="manifest.json")
+    parser.add_argument("--nthread", type=int, default=4)
+    parser.add_argument("--copies", type=int, default=None,
+                        help="cell copies run with the THREADSAFE set (defaults to 2 per thread)")
+    parser.add_argument("--amps", type=float, nargs="+", default=[-0.1, 0.1, 0.3])
+    parser.add_argument("--atol", type=float, default=0.0, help="allowed max |dV| (mV)")
+    args = parser.parse_args()
+
+    manifest_path = os.path.abspath(args.manifest)
+    copies = args.copies or 2 * args.nthread
+    if copies < args.nthread:
+        raise SystemExit("--copies must be at least --nthread, or some threads get no cell")
+    with tempfile.TemporaryDirectory() as tmp:
+        traces = {}
+        for label, modfile_dir, nthread, n_copies in [("original", args.original_dir, 1, 1),
+                                                      ("threadsafe", args.threadsafe_dir, args.nthread, copies)]:
+            build_dir = os.path.join(tmp, label)
+            compile_modfiles(os.path.abspath(modfile_dir), build_dir)
+            out_path = os.path.join(tmp, f"{label}.npy")
+            simulate(build_dir, manifest_path, nthread, n_copies, args.amps, out_path)
+            traces[label] = np.load(out_path)
+
+    # (amplitudes, copies): every THREADSAFE copy against the single-threaded reference
+    max_diff = np.max(np.abs(traces["threadsafe"] - traces["original"]), axis=2)
+    for amp, diffs in zip(args.amps, max_diff):
+        print(f"amp [ {amp:.3} ] nA  max |dV| = {diffs.max():.3e} mV (worst of {len(diffs)} copies, "
+              f"copy {int(diffs.argmax())})")
+    if np.any(max_diff > args.atol):
+        raise SystemExit("THREADSAFE traces differ from the originals")
+    print("THREADSAFE traces match the originals")
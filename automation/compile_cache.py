@@ -0,0 +1,125 @@
+import glob
+import hashlib
+import os
+import platform
+import re
+import shutil
+import subprocess
+import tempfile
+
+from automation.model_hash import hash_modfiles
+
+# mechanism libraries already loaded into this process, by cache key
+_loaded = {}
+
+def default_cache_dir():
+    """Shared build location: $NRN_COMPILE_CACHE or ~/.cache/single-cell-tuning/nrnivmodl."""
+    return os.environ.get("NRN_COMPILE_CACHE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "single-cell-tuning", "nrnivmodl"))
+
+def neuron_version():
+    """Version string of the installed NEURON."""
+    import neuron
+    return neuron.__version__
+
+def compile_key(modfile_dir):
+    """Hash of the modfile contents, the NEURON version and the machine architecture."""
+    digest = hashlib.sha256()
+    digest.update(hash_modfiles(modfile_dir).encode("utf-8"))
+    digest.update(neuron_version().encode("utf-8"))
+    digest.update(platform.machine().encode("utf-8"))
+    return digest.hexdigest()
+
+def find_library(build_dir):
+    """Path of the compiled mechanism library in an nrnivmodl build directory, or None."""
+    for pattern in ["*/.libs/libnrnmech.*", "*/libnrnmech.*"]:
+        matches = sorted(glob.glob(os.path.join(build_dir, pattern)))
+        if matches:
+            return matches[0]
+    return None
+
+def compiled_mechanisms(modfile_dir, cache_dir=None):
+    """
+    Return the path of a compiled mechanism library for modfile_dir, compiling it only
+    if this exact set of modfiles has not been built with this NEURON version before.
+
+    Builds happen in a temporary directory and are moved into place when complete, so
+    concurrent processes compiling the same set do not see partial builds.
+    """
+    cache_dir = cache_dir or default_cache_dir()
+    key = compile_key(modfile_dir)
+    build_dir = os.path.join(cache_dir, key)
+
+    library = find_library(build_dir)
+    if library is not None:
+        print(f"modfiles already compiled in {build_dir}. skipping")
+        return library
+
+    print(f"compiling modfiles from {modfile_dir}")
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix=f".{key[:12]}-")
+    try:
+        target = os.path.join(tmp_dir, "modfiles")
+        os.makedirs(target)
+        for name in sorted(os.listdir(modfile_dir)):
+            if name.endswith(".mod"):
+                shutil.copy(os.path.join(modfile_dir, name), target)
+        subprocess.run(["nrnivmodl", "modfiles"], cwd=tmp_dir, check=True)
+        try:
+            os.rename(tmp_dir, build_dir)
+        except OSError:
+            # another process finished the same build first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    library = find_library(build_dir)
+    if library is None:
+        raise RuntimeError(f"nrnivmodl did not produce a mechanism library in {build_dir}")
+    return library
+
+def modfile_mechanisms(modfile_dir):
+    """SUFFIX, POINT_PROCESS and ARTIFICIAL_CELL names declared by the .mod files in modfile_dir."""
+    names = set()
+    for name in sorted(os.listdir(modfile_dir)):
+        if name.endswith(".mod"):
+            with open(os.path.join(modfile_dir, name)) as file:
+                text = re.sub(r":[^\n]*", "", file.read())
+            names.update(re.findall(r"\b(?:SUFFIX|POINT_PROCESS|ARTIFICIAL_CELL)\s+(\w+)", text))
+    return names
+
+def registered_mechanisms(h):
+    """Names of the density mechanisms and point processes NEURON currently knows."""
+    names = set()
+    name = h.ref("")
+    for point_process in [0, 1]:
+        mechanism_type = h.MechanismType(point_process)
+        for i in range(int(mechanism_type.count())):
+            mechanism_type.select(i)
+            mechanism_type.selected(name)
+            names.add(name[0])
+    return names
+
+def load_mechanisms(h, modfile_dir, cache_dir=None):
+    """
+    Load the compiled mechanisms for modfile_dir into NEURON with h.nrn_load_dll.
+
+    Returns the library path. Loading the same set twice in one process is a no-op.
+    Raises RuntimeError if some of its mechanisms are already registered, e.g. because
+    `from neuron import h` auto-loaded a leftover x86_64/ build from the working
+    directory: loading them again would fail or silently keep the stale build.
+    """
+    key = compile_key(modfile_dir)
+    if key in _loaded:
+        return _loaded[key]
+    loaded = sorted(modfile_mechanisms(modfile_dir) & registered_mechanisms(h))
+    if loaded:
+        leftover = platform.machine()
+        hint = (f" NEURON auto-loaded the mechanisms in {os.path.abspath(leftover)}; remove that directory or "
+                f"run from another one." if os.path.isdir(leftover) else "")
+        raise RuntimeError(f"mechanisms {', '.join(loaded)} from {modfile_dir} are already loaded.{hint}")
+    library = compiled_mechanisms(modfile_dir, cache_dir)
+    h.nrn_load_dll(library)
+    _loaded[key] = library
+    return library
@@ -0,0 +1,240 @@
+# Downloads the Allen biophysical models of many cells concurrently into the local model store.
+#
+# example use:
+#   python -m automation.concurrent_download 488683425 488697163 --workers 16 --per-host 4
+#   python -m automation.concurrent_download cells.csv --stimulus
+#
+# Instead of one get_neuronal_models and one cache_data per cell, this
+#   1. resolves the neuronal model ids of all uncached cells with one query (cached per specimen
+#      in the store),
+#   2. queries the well known files (fit JSON, SWC, modfiles, NWB) of every model in a thread pool,
+#   3. downloads every distinct well known file once in the thread pool, with at most per_host
+#      requests per host. Modfiles shared by many cells have the same well known file id and are
+#      fetched once; files already in the store are not fetched at all. Every file is streamed to
+#      disk, checked against its Content-Length (and parsed if it is JSON), and stored by sha256,
+#      which also deduplicates identical files with different ids,
+#   4. writes each cell's manifest.json and store record, as cache_data would have.
+# Cells can then be checked out with ModelStore.checkout (or download_cell) without network access.
+
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from automation.model_store import ModelStore, _recording_api, default_base_uri
+
+class ConcurrentDownloader:
+    def __init__(self, store=None, max_workers=8, per_host=4, cache_stimulus=False, base_uri=None,
+                 chunk_size=1 << 20, retries=3):
+        """
+        Concurrent downloader of Allen biophysical models into a ModelStore (see module comment).
+
+        Parameters:
+          store         : ModelStore the files land in (defaults to ModelStore())
+          max_workers   : threads used for queries and file downloads
+          per_host      : maximum concurrent requests to one host
+          cache_stimulus: also download the (large) stimulus NWB files, streamed in chunk_size pieces
+          base_uri      : Allen API host (defaults to model_store.default_base_uri())
+          chunk_size    : bytes read per chunk while streaming a file to disk
+          retries       : attempts per file before giving up
+        """
+        self.store = store or ModelStore()
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.cache_stimulus = cache_stimulus
+        self.base_uri = base_uri or default_base_uri()
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.host_limits = {}
+        self.host_limits_lock = threading.Lock()
+
+    def host_limit(self, url):
+        """Semaphore bounding the concurrent requests to url's host."""
+        host = urlsplit(url).netloc
+        with self.host_limits_lock:
+            if host not in self.host_limits:
+                self.host_limits[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_limits[host]
+
+    def api(self, responses):
+        """A BiophysicalApi (one per thread; it keeps per-query state) recording its responses."""
+        return _recording_api(self.base_uri, responses)
+
+    # model ids
+
+    def model_id_path(self, specimen_id):
+        return os.path.join(self.store.root, "neuronal_models", f"{specimen_id}.json")
+
+    def model_ids(self, specimen_ids):
+        """
+        Neuronal model id of every specimen, from the store's query cache where possible and
+        from one get_neuronal_models query for the rest.
+
+        Returns:
+          {specimen_id: neuronal_model_id}
+        """
+        ids = {}
+        missing = []
+        for specimen_id in specimen_ids:
+            path = self.model_id_path(specimen_id)
+            if os.path.exists(path):
+                with open(path) as file:
+                    ids[specimen_id] = json.load(file)["id"]
+            else:
+                missing.append(specimen_id)
+
+        if missing:
+            responses = {}
+            query = self.api(responses).get_neuronal_models(missing)
+            self.store.put_responses(responses)
+            os.makedirs(os.path.dirname(self.model_id_path(missing[0])), exist_ok=True)
+            for model in query:
+                specimen_id = model["specimen_id"]
+                # the first model listed for a specimen, as query[0] in the single-cell script
+                if specimen_id in missing and specimen_id not in ids:
+                    ids[specimen_id] = model["id"]
+                    with open(self.model_id_path(specimen_id), "w") as file:
+                        json.dump(model, file)
+
+        not_found = [specimen_id for specimen_id in specimen_ids if specimen_id not in ids]
+        if not_found:
+            raise ValueError(f"No neuronal models found for specimens {not_found}")
+        return ids
+
+    # well known files
+
+    def well_known_files(self, neuronal_model_id):
+        """Query a model's well known files. Returns the BiophysicalApi holding ids, sweeps and model type."""
+        responses = {}
+        bp = self.api(responses)
+        with self.host_limit(bp.api_url):
+            bp.get_well_known_file_ids(neuronal_model_id)
+        self.store.put_responses(responses)
+        return bp
+
+    def fetch_file(self, url, filename):
+        """
+        Stream url into the store and verify it. Returns the sha256 of its contents.
+
+        Raises:
+          IOError if the file could not be downloaded completely in self.retries attempts.
+        """
+        for attempt in range(1, self.retries + 1):
+            fd, tmp_path = tempfile.mkstemp(dir=self.store.root, prefix=".download-")
+            try:
+                digest = hashlib.sha256()
+                size = 0
+                with os.fdopen(fd, "wb") as file, self.host_limit(url), urllib.request.urlopen(url) as response:
+                    expected_size = response.headers.get("Content-Length")
+                    while True:
+                        chunk = response.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        digest.update(chunk)
+                        file.write(chunk)
+                        size += len(chunk)
+                if expected_size is not None and size != int(expected_size):
+                    raise IOError(f"incomplete download of {filename}: {size} of {expected_size} bytes")
+                if filename.endswith(".json"):
+                    with open(tmp_path) as file:
+                        json.load(file)
+                return self.store.put_verified(tmp_path, digest.hexdigest())
+            except (IOError, ValueError) as e:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                if attempt == self.retries:
+                    raise IOError(f"could not download {filename} from {url}: {e}") from e
+                time.sleep(2 ** attempt)
+
+    def manifest(self, bp):
+        """manifest.json contents for a queried model, as written by BiophysicalApi.cache_data."""
+        fit_path = list(bp.ids['fit'].values())[0]
+        stimulus_filename = list(bp.ids['stimulus'].values())[0]
+        swc_path = list(bp.ids['morphology'].values())[0]
+        marker_path = list(bp.ids['marker'].values())[0] if bp.ids.get('marker') else None
+        bp.create_manifest(fit_path, bp.model_type, stimulus_filename, swc_path, marker_path, sorted(bp.sweeps))
+        return json.dumps(bp.manifest, indent=2).encode("utf-8")
+
+    # cells
+
+    def download(self, specimen_ids):
+        """
+        Make sure every specimen's model is in the store.
+
+        Returns:
+          {specimen_id: model record}
+        """
+        records = {}
+        pending = []
+        for specimen_id in dict.fromkeys(specimen_ids):
+            record = self.store.get_model(specimen_id)
+            if record is not None and (record["stimulus"] or not self.cache_stimulus):
+                records[specimen_id] = record
+            else:
+                pending.append(specimen_id)
+        print(f"{len(records)} cells already in {self.store.root}, downloading {len(pending)}")
+        if not pending:
+            return records
+
+        start = time.perf_counter()
+        model_ids = self.model_ids(pending)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            apis = dict(zip(pending, pool.map(self.well_known_files, [model_ids[specimen_id] for specimen_id in pending])))
+
+            # one download per distinct well known file that is not yet stored
+            to_fetch = {}
+            for bp in apis.values():
+                for key, id_dict in bp.ids.items():
+                    if key == 'stimulus' and not self.cache_stimulus:
+                        continue
+                    for wkf_id, filename in id_dict.items():
+                        if wkf_id not in to_fetch and self.store.well_known_file_digest(wkf_id) is None:
+                            to_fetch[wkf_id] = (bp.construct_well_known_file_download_url(wkf_id), filename)
+            futures = {wkf_id: pool.submit(self.fetch_file, url, filename)
+                       for wkf_id, (url, filename) in to_fetch.items()}
+            for wkf_id, future in futures.items():
+                self.store.put_well_known_file(wkf_id, future.result())
+        n_referenced = sum(len(id_dict) for bp in apis.values() for key, id_dict in bp.ids.items()
+                           if key != 'stimulus' or self.cache_stimulus)
+
+        for specimen_id in pending:
+            bp = apis[specimen_id]
+            files = {}
+            well_known_files = {}
+            for key, id_dict in bp.ids.items():
+                if key == 'stimulus' and not self.cache_stimulus:
+                    continue
+                for wkf_id, filename in id_dict.items():
+                    well_known_files[wkf_id] = files[os.path.normpath(filename)] = self.store.well_known_file_digest(wkf_id)
+            files["manifest.json"] = self.store.put_bytes(self.manifest(bp))
+            records[specimen_id] = self.store.put_record(specimen_id, model_ids[specimen_id], files, ["work"],
+                                                         well_known_files, self.cache_stimulus)
+
+        print(f"downloaded {len(to_fetch)} distinct files for {n_referenced} file references of {len(pending)} cells "
+              f"in {time.perf_counter() - start:.1f} s")
+        return records
+
+def main(argv=None):
+    # imported here so that importing this module does not need the tuning script's dependencies
+    from automation.batch_tune_r_in import read_cells
+
+    parser = argparse.ArgumentParser(description="Download many Allen biophysical models into the local model store.")
+    parser.add_argument("cells", nargs="+", help="specimen ids, cell types URLs, or .txt/.csv files listing them")
+    parser.add_argument("--root", default=None, help="model store directory")
+    parser.add_argument("--workers", type=int, default=8, help="download threads")
+    parser.add_argument("--per-host", type=int, default=4, help="maximum concurrent requests per host")
+    parser.add_argument("--stimulus", action="store_true", help="also download the stimulus NWB files")
+    args = parser.parse_args(argv)
+
+    specimen_ids = [specimen_id for specimen_id, _ in read_cells(args.cells)]
+    downloader = ConcurrentDownloader(ModelStore(args.root), args.workers, args.per_host, args.stimulus)
+    return downloader.download(specimen_ids)
+
+if __name__ == "__main__":
+    main()
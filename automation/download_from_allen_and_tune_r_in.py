@@ -2,20 +2,26 @@
 # or: python download_from_allen_and_tune_r_in "http://celltypes.brain-map.org/experiment/electrophysiology/488683425" "user_specifications.json"
 # or python download_from_allen_and_tune_r_in 488683425
 # or python download_from_allen_and_tune_r_in "http://celltypes.brain-map.org/experiment/electrophysiology/488683425"
+# add --no-plot to skip writing voltage_trace_Rin.png (matplotlib is then never imported)
 
+# allensdk and NEURON are imported only on the code paths that need them (see model_store.ModelStore.download
+# and cell_builder.build_cell) because this script is launched thousands of times from job arrays.
+# Check the startup cost with: python -m automation.benchmark_startup
 
-
-from allensdk.api.queries.biophysical_api import BiophysicalApi
-from allensdk.model.biophys_sim.config import Config
-from allensdk.model.biophysical.utils import Utils
+import argparse
 import re
 import json
 import numpy as np
-import subprocess
-import sys
 import os
+import time
 
 from automation.Simulation import RInSimulation
+from automation.cell_builder import build_cell
+from automation.compile_cache import compiled_mechanisms
+from automation.model_hash import hash_model
+from automation.model_store import ModelStore
+from automation.r_in_tuner import RInTuner
+from automation.result_cache import ResultCache
 
 def robust_int_conversion(input_value):
   """
@@ -75,19 +81,6 @@ def load_dictionary_from_json(file_path):
   except FileNotFoundError:
     raise FileNotFoundError(f"File not found: {file_path}")
 
-def update_missing_passive_values(utils, user_specs_dict):
-  # update missing properties to user_specs_dict if they're not already in the allen specifications
-  if "e_pas" not in utils.description.data["passive"][0].keys():
-    utils.description.data["passive"][0]["e_pas"] = user_specs_dict["e_pas"]
-  
-  if "cm" not in utils.description.data["passive"][0].keys():
-    utils.description.data["passive"][0]["cm"] = user_specs_dict["cm"]
-  
-  if "ra" not in utils.description.data["passive"][0].keys():
-    utils.description.data["passive"][0]["ra"] = user_specs_dict["ra"]
-
-  return utils
-
 def measure_soma_surface_area(h):
   # calculate soma surface area
   # in NEURON each segment is cylindrical, however
@@ -110,105 +103,167 @@ def estimate_gbar_leak_for_user_spec_rin(soma_surface_area, user_specs_dict):
   print(f"gbar_leak_estimate {gbar_leak_estimate:.5} S / cm2") # needs to be in S / cm2
   return gbar_leak_estimate
 
-def update_sections(value_to_assign: float, data: dict, sections: list = ['soma'], var_to_update: list = ['g_pas']):
+def update_sections(value_to_assign: float, data: dict, sections: list = ['soma'], var_to_update: list = ['g_pas'],
+                    verbose: bool = False):
+  """Return a copy of the genome entries data with var_to_update set to value_to_assign in sections.
+
+  Each change is printed only if verbose is True, so batch runs do not log every section.
+  """
   original_entries = []
   corresponding_new_entries = []
 
-  original_assignments = data.copy()
-  new_assignments = original_assignments.copy()
-
-  # print(original_assignments)
+  # copy the entries too so the caller's genome dicts are not modified
+  new_assignments = [entry.copy() for entry in data]
 
   for entry in new_assignments: # each entry is the assignment of a conductance somewhere
     if (entry['section'] in sections) or ('all' in sections):
       # print(f"entry: {entry}")
       if (entry['name'] in var_to_update) or ('all' in var_to_update):
-        print(f" updating entry: {entry}")
+        if verbose:
+          print(f" updating entry: {entry}")
         original_entries.append(entry.copy())
 
         entry['value'] = value_to_assign
         corresponding_new_entries.append(entry)
 
-  for i,orig_entry in enumerate(original_entries):
+  for i,orig_entry in enumerate(original_entries if verbose else []):
     print(f"updating {orig_entry['section']} {orig_entry['name']} from {orig_entry['value']:.3} to {corresponding_new_entries[i]['value']:.3}")  #percent change: {(((corresponding_new_entries[i]['value'] - orig_entry['value']) / orig_entry['value']) * 100):.3}")
 
   # return original_assignments, new_assignments, original_entries, corresponding_new_entries
   return new_assignments
 
-if __name__ == "__main__":
-  if len(sys.argv) > 1:
-    int = sys.argv[1]
-    print(f"getting cell {int}")
-  else:
-    raise(ValueError("No argument provided."))
+def is_downloaded(specimen_id, manifest_path='manifest.json'):
+  """Whether the working directory already holds the downloaded model for specimen_id."""
+  if not os.path.exists(manifest_path):
+    return False
+  manifest = load_dictionary_from_json(manifest_path)
+  model_files = [name for biophys in manifest.get("biophys", []) for name in biophys.get("model_file", [])]
+  fit_file = f"{specimen_id}_fit.json"
+  return fit_file in model_files and os.path.exists(fit_file) and os.path.isdir("modfiles")
 
-  # load user specifications
-  if len(sys.argv) > 2: # third argument expecting a json
-    user_specs_dict = load_dictionary_from_json(sys.argv[2])
-  else:
-    user_specs_dict = None
-    
-  bp = BiophysicalApi()
-  query = bp.get_neuronal_models(int)
+def download_cell(specimen_id, store=None):
+  """Write the biophysical model for specimen_id into the working directory.
 
-  bp.cache_stimulus = False # Change to False to not download the large stimulus NWB file
-  bp.cache_data(query[0]['id']) # 'id'
-
-  # compile the downloaded modfiles
-  if not os.path.exists("x86_64"):
-    print("compiling modfiles")
-    subprocess.run("nrnivmodl modfiles", shell=True, check=True)
-  else:
-    print("modfiles already compiled. skipping")
+  The model is downloaded with BiophysicalApi only if it is not already in the local model store
+  (see model_store.py). Set ALLEN_API_BASE_URI to download from a local stand-in server.
+  """
+  store = store or ModelStore()
+  store.fetch(specimen_id, working_directory='.', cache_stimulus=False) # True to also get the large stimulus NWB file
 
-  # Create the h object
-  description = Config().load('manifest.json')
-  utils = Utils(description)
-  h = utils.h
+def tune_r_in(specimen_id, user_specs_dict, plot=True, download=True, result_cache_path='feature_cache.sqlite'):
+  """Download (if needed), build and tune soma g_pas for one cell in the working directory.
 
-  # convert 'values' from string to float
-  for dict in utils.description.data['genome']:
-    for key,item in dict.items():
-      if key == 'value':
-        dict[key] = float(item)
+  Args:
+    specimen_id: Allen cell types specimen id.
+    user_specs_dict: user specifications with at least 'R-in'.
+    plot: save the R_in voltage traces to voltage_trace_Rin.png.
+    download: download the model unless it is already in the working directory.
+    result_cache_path: SQLite file of R_in measurements by model, protocol and g_pas, so a
+      rerun does not simulate evaluations it has already made (None to always simulate).
 
-  if user_specs_dict:
-    utils = update_missing_passive_values(utils, user_specs_dict)
+  Returns:
+    A dictionary with the original and new R_in and soma g_pas, the number of evaluations
+    and the wall time (s) of each stage.
+  """
+  timings = {}
+  start = time.perf_counter()
+  print(f"getting cell {specimen_id}")
+  if not download:
+    print("download disabled. using the model in the working directory")
+  elif is_downloaded(specimen_id):
+    print("cell already downloaded. skipping")
+  else:
+    download_cell(specimen_id)
+  timings["download"] = time.perf_counter() - start
 
-  # read morphology
-  manifest = description.manifest
-  morphology_path = description.manifest.get_path('MORPHOLOGY')
-  utils.generate_morphology(morphology_path.encode('ascii', 'ignore'))
+  # the downloaded modfiles are compiled once per unique set (no-op if already in the compile cache)
+  start = time.perf_counter()
+  compiled_mechanisms('modfiles')
+  timings["compile"] = time.perf_counter() - start
 
   # build the cell. Its parts will be assigned to the h object
-  utils.load_cell_parameters()
+  start = time.perf_counter()
+  utils = build_cell('manifest.json', user_specs_dict, modfile_dir='modfiles')
+  h = utils.h
+  timings["build"] = time.perf_counter() - start
 
   # h.soma[0].g_pas = 1.017e-04
 
-  r_in_sim_obj = RInSimulation(h)
+  start = time.perf_counter()
+  r_in_sim_obj = RInSimulation(h, plot=plot)
+  desired_r_in = user_specs_dict['R-in']
+
+  result_cache = None
+  model_key = None
+  if result_cache_path is not None:
+    result_cache = ResultCache(result_cache_path)
+    model_key = hash_model(utils.description.data, utils.description.manifest.get_path('MORPHOLOGY'), 'modfiles')
+
+  # iterate on soma g_pas from the estimate until R_in is within tolerance of the target
+  tuner = RInTuner(h, r_in_sim_obj, desired_r_in, sections=['soma'],
+                   tolerance=user_specs_dict.get('R-in tolerance', 1.0),
+                   max_evals=user_specs_dict.get('max evaluations', 12),
+                   result_cache=result_cache, model_key=model_key)
+
   original_soma_g_pas = h.soma[0].g_pas
   print(f"original_soma_g_pas {original_soma_g_pas:.5} S / cm2")
-  original_r_in = r_in_sim_obj.measure_r_in()
+  original_r_in = tuner.measure(original_soma_g_pas)
 
   soma_surface_area = measure_soma_surface_area(h)
 
   gbar_leak_estimate = estimate_gbar_leak_for_user_spec_rin(soma_surface_area, user_specs_dict)
 
+  tuned_g_pas = tuner.tune(gbar_leak_estimate)
+  new_r_in = tuner.best['r_in']
+  if result_cache is not None:
+    result_cache.close()
+
   utils.description.data["genome"] = update_sections(
-                  value_to_assign = gbar_leak_estimate,
+                  value_to_assign = tuned_g_pas,
                   sections = ['soma'],
                   var_to_update = ['g_pas'], 
                   data = utils.description.data["genome"])
   
   utils.load_cell_parameters()
+  timings["tune"] = time.perf_counter() - start
 
-  new_r_in = r_in_sim_obj.measure_r_in()
-
-  desired_r_in = user_specs_dict['R-in']
   # percent_change = ((new_r_in - original_r_in) / original_r_in) * 100
   print(f"desired_r_in {desired_r_in} MOhm")
   print(f"original_r_in {original_r_in:.5} MOhm")
   print(f"original percent error {(((original_r_in - desired_r_in) / desired_r_in) * 100):.5}%")
   print(f"new_r_in {new_r_in:.5} MOhm")
   print(f"percent error {(((new_r_in - desired_r_in) / desired_r_in) * 100):.5}%")
+  print(f"evaluations {len(tuner.log)}")
   # print(f"percent_change {percent_change:.5}%")
+
+  return {"specimen_id": specimen_id,
+          "desired_r_in": desired_r_in,
+          "original_r_in": original_r_in,
+          "new_r_in": new_r_in,
+          "original_g_pas": original_soma_g_pas,
+          "new_g_pas": tuned_g_pas,
+          "evaluations": len(tuner.log),
+          "timings": timings}
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Download an Allen biophysical model and tune its soma g_pas to a target R_in.")
+  parser.add_argument("cell", help="specimen id or cell types URL")
+  parser.add_argument("user_specifications", nargs="?", help="JSON file with user specifications")
+  parser.add_argument("--no-plot", action="store_true", help="do not save voltage trace plots (headless)")
+  parser.add_argument("--no-download", action="store_true", help="use the model already in the working directory")
+  parser.add_argument("--no-result-cache", action="store_true", help="simulate every evaluation even if it was cached")
+  args = parser.parse_args(argv)
+
+  specimen_id = robust_int_conversion(args.cell)
+
+  # load user specifications
+  if args.user_specifications: # second argument expecting a json
+    user_specs_dict = load_dictionary_from_json(args.user_specifications)
+  else:
+    user_specs_dict = None
+
+  return tune_r_in(specimen_id, user_specs_dict, plot=not args.no_plot, download=not args.no_download,
+                   result_cache_path=None if args.no_result_cache else 'feature_cache.sqlite')
+
+if __name__ == "__main__":
+  main()
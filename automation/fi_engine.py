@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+
+import numpy as np
+
+# per-process state, filled in by _init_worker
+_worker = {}
+
+def _init_worker(manifest_path, user_specs_dict, genome_overrides, soma_diam_scale, modfile_dir, sim_kwargs):
+    """Build the cell once in this worker process."""
+    # imported here so the parent process does not have to load NEURON
+    from automation.cell_builder import build_cell
+    from automation.Simulation import FISimulation
+
+    utils = build_cell(manifest_path, user_specs_dict, genome_overrides, soma_diam_scale, modfile_dir)
+    _worker["utils"] = utils
+    _worker["sim"] = FISimulation(utils.h, **sim_kwargs)
+
+def _run_amplitudes(indexed_amplitudes):
+    """Evaluate a slice of (index, amplitude) pairs on this worker's cell."""
+    sim = _worker["sim"]
+    results = []
+    for index, amp in indexed_amplitudes:
+        spike_times = sim.run_amplitude(amp)
+        results.append((index, sim.firing_rate(spike_times), spike_times))
+    return results
+
+class FIResult:
+    def __init__(self, amplitudes, firing_rates, spike_times):
+        """
+        Merged FI curve.
+
+        Parameters:
+          amplitudes  : injected currents (nA), in the order they were requested
+          firing_rates: firing rate for each amplitude (Hz)
+          spike_times : list with one NumPy array of spike times (ms) per amplitude
+        """
+        self.amplitudes = np.asarray(amplitudes)
+        self.firing_rates = np.asarray(firing_rates)
+        self.spike_times = spike_times
+
+    def to_dict(self):
+        """Return the result as plain lists (JSON-serializable)."""
+        return {"amplitudes": self.amplitudes.tolist(),
+                "firing_rates": self.firing_rates.tolist(),
+                "spike_times": [times.tolist() for times in self.spike_times]}
+
+class FIEngine:
+    def __init__(self, manifest_path="manifest.json", n_workers=None, user_specs_dict=None,
+                 genome_overrides=None, soma_diam_scale=1.0, modfile_dir=None, **sim_kwargs):
+        """
+        Evaluate FI curves in a pool of worker processes.
+
+        Each worker builds the cell from manifest_path once and then simulates the
+        amplitudes it is given. The pool is kept between run() calls; call close()
+        (or use the engine as a context manager) when finished.
+
+        Parameters:
+          manifest_path   : path to the manifest.json written by BiophysicalApi.cache_data
+          n_workers       : number of worker processes (defaults to the CPU count)
+          user_specs_dict : optional user specifications used to fill missing passive values
+          genome_overrides: optional list of {"section", "name", "value"} genome changes
+          soma_diam_scale : factor applied to soma[0].diam after building
+          modfile_dir     : optional modfile directory loaded through the compile cache
+          sim_kwargs      : passed on to FISimulation (stim_delay, stim_dur, tstop, dt, spike_threshold)
+        """
+        self.manifest_path = manifest_path
+        self.n_workers = n_workers or os.cpu_count()
+        self.user_specs_dict = user_specs_dict
+        self.genome_overrides = genome_overrides
+        self.soma_diam_scale = soma_diam_scale
+        self.modfile_dir = modfile_dir
+        self.sim_kwargs = sim_kwargs
+        self.pool = None
+
+    def start(self):
+        """Start the worker processes. Called by run() if needed."""
+        # spawn so that workers get a clean NEURON instance even if this process already built a cell
+        context = multiprocessing.get_context("spawn")
+        self.pool = context.Pool(
+            self.n_workers,
+            initializer=_init_worker,
+            initargs=(self.manifest_path, self.user_specs_dict, self.genome_overrides,
+                      self.soma_diam_scale, self.modfile_dir, self.sim_kwargs))
+
+    def run(self, amplitudes=None):
+        """
+        Simulate every amplitude and merge the results.
+
+        Parameters:
+          amplitudes : injected currents (nA). Defaults to np.arange(-0.1, 0.325, 0.025).
+
+        Returns:
+          FIResult
+        """
+        if amplitudes is None:
+            amplitudes = np.arange(-0.1, 0.325, 0.025)
+        amplitudes = np.asarray(amplitudes, dtype=float)
+        if self.pool is None:
+            self.start()
+
+        # interleave the slices so large (slow, spiking) amplitudes are spread over workers
+        indexed = list(enumerate(amplitudes))
+        n_slices = min(self.n_workers, len(indexed))
+        slices = [indexed[i::n_slices] for i in range(n_slices)]
+
+        firing_rates = np.zeros(len(amplitudes))
+        spike_times = [None] * len(amplitudes)
+        for results in self.pool.map(_run_amplitudes, slices):
+            for index, rate, times in results:
+                firing_rates[index] = rate
+                spike_times[index] = times
+
+        return FIResult(amplitudes, firing_rates, spike_times)
+
+    def close(self):
+        """Shut down the worker processes."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,108 @@
+import numpy as np
+
+from automation.fi_engine import FIResult
+
+def simulation_evaluator(sim):
+    """Wrap an FISimulation as an evaluate function for AdaptiveFISampler (one process, serial)."""
+    def evaluate(amplitudes):
+        spike_times = [sim.run_amplitude(amp) for amp in amplitudes]
+        return FIResult(amplitudes, [sim.firing_rate(times) for times in spike_times], spike_times)
+    return evaluate
+
+class AdaptiveFISampler:
+    def __init__(self, evaluate, amp_min=-0.1, amp_max=0.3, budget=12, rheobase_tol=0.005,
+                 rheobase_share=0.5, batch_size=1):
+        """
+        FI curve sampling that spends simulations where they are informative.
+
+        First the rheobase is bracketed between amp_min and amp_max and the bracket is
+        narrowed by bisection (or, with batch_size > 1, by splitting it into
+        batch_size + 1 parts per round). The remaining budget goes to the
+        suprathreshold intervals where the piecewise-linear FI curve bends most.
+
+        Parameters:
+          evaluate      : function taking a list of amplitudes (nA) and returning an FIResult,
+                          e.g. FIEngine(...).run or simulation_evaluator(FISimulation(h))
+          amp_min       : lowest amplitude considered (nA)
+          amp_max       : highest amplitude considered (nA)
+          budget        : maximum number of simulated amplitudes
+          rheobase_tol  : stop narrowing the rheobase bracket once it is this narrow (nA)
+          rheobase_share: fraction of the budget the rheobase search may use
+          batch_size    : amplitudes evaluated per call to evaluate (use the worker count with FIEngine)
+        """
+        self.evaluate = evaluate
+        self.amp_min = amp_min
+        self.amp_max = amp_max
+        self.budget = budget
+        self.rheobase_tol = rheobase_tol
+        self.rheobase_share = rheobase_share
+        self.batch_size = batch_size
+        self.samples = {}  # amplitude -> (firing rate, spike times)
+
+    def run_batch(self, amplitudes):
+        amplitudes = [amp for amp in amplitudes if amp not in self.samples][:self.remaining()]
+        if not amplitudes:
+            return
+        result = self.evaluate(amplitudes)
+        for amp, rate, times in zip(result.amplitudes, result.firing_rates, result.spike_times):
+            self.samples[float(amp)] = (float(rate), times)
+
+    def remaining(self):
+        return self.budget - len(self.samples)
+
+    def rheobase_bracket(self):
+        """(highest silent amplitude, lowest firing amplitude); either may be None."""
+        silent = [amp for amp, (rate, _) in self.samples.items() if rate == 0]
+        firing = [amp for amp, (rate, _) in self.samples.items() if rate > 0]
+        lowest_firing = min(firing) if firing else None
+        silent = [amp for amp in silent if lowest_firing is None or amp < lowest_firing]
+        return (max(silent) if silent else None), lowest_firing
+
+    def search_rheobase(self):
+        self.run_batch([self.amp_min, self.amp_max])
+        limit = self.budget * self.rheobase_share
+        while len(self.samples) < limit and self.remaining() > 0:
+            low, high = self.rheobase_bracket()
+            if low is None or high is None or high - low <= self.rheobase_tol:
+                break
+            n = int(min(self.batch_size, limit - len(self.samples), self.remaining()))
+            self.run_batch(list(np.linspace(low, high, max(n, 1) + 2)[1:-1]))
+
+    def refine(self):
+        """Add amplitudes in the suprathreshold intervals where the FI curve bends most."""
+        while self.remaining() > 0:
+            low, _ = self.rheobase_bracket()
+            amps = np.array(sorted(amp for amp in self.samples if low is None or amp >= low))
+            if len(amps) < 2:
+                break
+            rates = np.array([self.samples[amp][0] for amp in amps])
+            widths = np.diff(amps)
+            slopes = np.diff(rates) / widths
+            # change in slope on either side of each interval (0 at the ends)
+            bends = np.abs(np.diff(slopes))
+            left = np.concatenate([[0.0], bends])
+            right = np.concatenate([bends, [0.0]])
+            scores = widths * np.maximum(left, right)
+            if not np.any(scores > 0):
+                scores = widths  # no curvature information yet: split the widest intervals
+            order = np.argsort(scores)[::-1][:min(self.batch_size, self.remaining())]
+            midpoints = [0.5 * (amps[i] + amps[i + 1]) for i in order if widths[i] > self.rheobase_tol / 2]
+            if not midpoints:
+                break
+            self.run_batch(midpoints)
+
+    def run(self):
+        """
+        Sample the FI curve within the budget.
+
+        Returns:
+          FIResult sorted by amplitude, and the rheobase bracket (highest silent amplitude,
+          lowest firing amplitude) in nA
+        """
+        self.search_rheobase()
+        self.refine()
+        amplitudes = sorted(self.samples)
+        result = FIResult(amplitudes,
+                          [self.samples[amp][0] for amp in amplitudes],
+                          [self.samples[amp][1] for amp in amplitudes])
+        return result, self.rheobase_bracket()
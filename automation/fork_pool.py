@@ -0,0 +1,171 @@
+import copy
+import multiprocessing
+import os
+import time
+
+from automation.cell_builder import build_cell
+from automation.genome_table import GenomeTable
+from automation.parameter_delta import DeltaApplier
+from automation.protocols import StepProtocol
+from automation.Simulation import FISimulation, RInSimulation
+
+# The cell image of the pool being started, set by ForkedCellPool.start in the parent just before
+# the workers are forked. Workers inherit it (NEURON state included) copy-on-write instead of
+# building their own.
+_image = {}
+
+def run_protocol(h, protocol):
+    """
+    Run one protocol spec on the cell in h and return its results as plain Python values.
+
+    Protocol specs are dicts with a "protocol" key; the other keys are passed on:
+      {"protocol": "r_in", "method": "transient", **RInSimulation kwargs}
+          -> {"r_in"}
+      {"protocol": "fi", "amplitudes": [...], **FISimulation kwargs}
+          -> {"amplitudes", "firing_rates", "spike_times"}
+      {"protocol": "rheobase", "amp_low", "amp_high", "tol", **FISimulation kwargs}
+          -> {"rheobase"}
+      {"protocol": "steps", "traces": False, **StepProtocol.passive_and_firing kwargs}
+          -> the StepProtocol.run features (t and v only if traces is True)
+    """
+    params = {key: value for key, value in protocol.items() if key != "protocol"}
+    kind = protocol["protocol"]
+    if kind == "r_in":
+        method = params.pop("method", "transient")
+        # no plots from the workers: they would all write voltage_trace_Rin.png in the same directory
+        params.setdefault("plot", False)
+        return {"r_in": float(RInSimulation(h, **params).measure_r_in(method))}
+    elif kind == "fi":
+        amplitudes = params.pop("amplitudes")
+        sim = FISimulation(h, **params)
+        spike_times = [sim.run_amplitude(amp) for amp in amplitudes]
+        return {"amplitudes": list(amplitudes),
+                "firing_rates": [float(sim.firing_rate(times)) for times in spike_times],
+                "spike_times": [times.tolist() for times in spike_times]}
+    elif kind == "rheobase":
+        search = {key: params.pop(key) for key in ["amp_low", "amp_high", "tol", "max_trials"] if key in params}
+        return {"rheobase": FISimulation(h, **params).find_rheobase(**search)}
+    elif kind == "steps":
+        traces = params.pop("traces", False)
+        features = StepProtocol.passive_and_firing(**params).run(h)
+        if not traces:
+            features.pop("t")
+            features.pop("v")
+        return features
+    else:
+        raise ValueError(f"Unknown protocol: {kind}")
+
+def _run_task(task):
+    """Reset the inherited cell to the base parameters, apply one delta and run its protocol."""
+    delta, protocol = task
+    applier = _image["applier"]
+    applier.table.values[:] = _image["base_values"]
+    applier.passive = copy.deepcopy(_image["base_passive"])
+
+    for change in delta.get("genome", []):
+        applier.table.set(change["section"], change["name"], float(change["value"]))
+    passive = delta.get("passive", {})
+    for key in ["ra", "e_pas"]:
+        if key in passive:
+            applier.set_passive(key, float(passive[key]))
+    for section, cm in passive.get("cm", {}).items():
+        applier.set_passive("cm", float(cm), section)
+
+    # only the values that differ from the previous task on this worker are written to the cell
+    applier.apply()
+    return run_protocol(_image["utils"].h, protocol)
+
+class ForkedCellPool:
+    def __init__(self, manifest_path="manifest.json", n_workers=None, user_specs_dict=None,
+                 genome_overrides=None, soma_diam_scale=1.0, modfile_dir=None):
+        """
+        Worker pool forked from a parent process that has already built the cell.
+
+        The cell is built once (manifest, Config().load, Utils, generate_morphology,
+        load_cell_parameters) in this process, then the workers are forked from it and share
+        its memory copy-on-write. Tasks carry only a parameter delta and a protocol spec;
+        each worker resets the cell to the base parameters, writes the delta with a
+        DeltaApplier and runs the protocol (see run_protocol).
+
+        Needs the "fork" start method (Linux, macOS). Use FIEngine where workers must be
+        spawned instead. Changes made to this process's cell after start() are not seen by
+        the workers. The image belongs to the pool: another pool in the same process builds
+        its own, so give each pool its own process when they are for different cells (the
+        Allen cell is built into NEURON's top level, where earlier cells' sections remain).
+
+        Parameters:
+          manifest_path   : path to the manifest.json written by BiophysicalApi.cache_data
+          n_workers       : number of worker processes (defaults to the CPU count)
+          user_specs_dict : optional user specifications used to fill missing passive values
+          genome_overrides: optional list of {"section", "name", "value"} genome changes in the base cell
+          soma_diam_scale : factor applied to soma[0].diam after building
+          modfile_dir     : optional modfile directory loaded through the compile cache
+        """
+        self.manifest_path = manifest_path
+        self.n_workers = n_workers or os.cpu_count()
+        self.user_specs_dict = user_specs_dict
+        self.genome_overrides = genome_overrides
+        self.soma_diam_scale = soma_diam_scale
+        self.modfile_dir = modfile_dir
+        self.pool = None
+        self.image = None       # the built cell, GenomeTable, DeltaApplier and base values
+        self.build_time = None  # time spent building the cell image (s)
+        self.fork_time = None   # time spent starting the workers (s)
+
+    def start(self):
+        """Build the cell image (once) and fork the workers. Called by run() if needed."""
+        if self.image is None:
+            start = time.perf_counter()
+            utils = build_cell(self.manifest_path, self.user_specs_dict, self.genome_overrides,
+                               self.soma_diam_scale, self.modfile_dir)
+            table = GenomeTable(utils.description.data["genome"])
+            applier = DeltaApplier(utils.h, table, utils.description.data["passive"][0])
+            self.image = {"utils": utils,
+                          "applier": applier,
+                          "base_values": table.values.copy(),
+                          "base_passive": copy.deepcopy(applier.passive)}
+            self.build_time = time.perf_counter() - start
+            print(f"built cell image in {self.build_time:.2f} s")
+
+        # the workers forked below inherit this pool's image, whatever another pool set before
+        _image.clear()
+        _image.update(self.image)
+        start = time.perf_counter()
+        context = multiprocessing.get_context("fork")
+        self.pool = context.Pool(self.n_workers)
+        self.fork_time = time.perf_counter() - start
+        print(f"forked {self.n_workers} workers in {self.fork_time:.3f} s")
+
+    def run(self, tasks, chunksize=1):
+        """
+        Run (delta, protocol) tasks on the workers.
+
+        Parameters:
+          tasks    : list of (delta, protocol) pairs. delta is {"genome": [{"section", "name", "value"}, ...],
+                     "passive": {"ra": ..., "e_pas": ..., "cm": {section: cm}}} (every key optional),
+                     relative to the base cell; protocol is a spec for run_protocol
+          chunksize: tasks sent to a worker at once
+
+        Returns:
+          the results in task order
+        """
+        if self.pool is None:
+            self.start()
+        return self.pool.map(_run_task, tasks, chunksize)
+
+    def sweep(self, deltas, protocol, chunksize=1):
+        """Run the same protocol for every delta."""
+        return self.run([(delta, protocol) for delta in deltas], chunksize)
+
+    def close(self):
+        """Shut down the worker processes. The cell image stays built for a later start()."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
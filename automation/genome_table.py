@@ -0,0 +1,110 @@
+import copy
+import json
+
+import numpy as np
+
+class GenomeTable:
+    def __init__(self, genome):
+        """
+        Indexed, NumPy-backed store of a fit's genome.
+
+        Each genome entry gets a slot; (section, name) -> slot is a dict lookup and the
+        values live in one float array, so single and bulk updates do not scan the
+        genome list. Entry fields other than "value" (e.g. "mechanism") are kept for
+        export back to the fit JSON format.
+
+        Parameters:
+          genome: the fit's genome list, e.g. utils.description.data["genome"]. It is copied, not modified.
+        """
+        self.entries = [copy.deepcopy(entry) for entry in genome]
+        self.sections = np.array([entry["section"] for entry in self.entries])
+        self.names = np.array([entry["name"] for entry in self.entries])
+        self.values = np.array([float(entry["value"]) for entry in self.entries])
+        self.slots = {}
+        for slot, entry in enumerate(self.entries):
+            key = (entry["section"], entry["name"])
+            if key in self.slots:
+                raise ValueError(f"Duplicate genome entry for {key[0]} {key[1]}")
+            self.slots[key] = slot
+        # slots of every section that has a given parameter, for section 'all'
+        self.name_slots = {name: np.flatnonzero(self.names == name) for name in np.unique(self.names)}
+
+    @classmethod
+    def from_fit_json(cls, file_path):
+        """Build a table from the genome of a fit JSON file."""
+        with open(file_path, "r") as file:
+            return cls(json.load(file)["genome"])
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, key):
+        return tuple(key) in self.slots
+
+    def slot(self, section, name):
+        """Slot index of (section, name)."""
+        try:
+            return self.slots[(section, name)]
+        except KeyError:
+            raise KeyError(f"No genome entry for {section} {name}") from None
+
+    def lookup(self, section, name):
+        """Slot indices for (section, name); section 'all' selects every section with that name."""
+        if section == "all":
+            if name not in self.name_slots:
+                raise KeyError(f"No genome entry named {name}")
+            return self.name_slots[name]
+        return np.array([self.slot(section, name)])
+
+    def get(self, section, name):
+        return self.values[self.slot(section, name)]
+
+    def set(self, section, name, value):
+        """Assign value to (section, name); section 'all' assigns it in every section."""
+        self.values[self.lookup(section, name)] = value
+
+    def get_many(self, keys):
+        """Values for a list of (section, name) pairs."""
+        return self.values[[self.slot(section, name) for section, name in keys]]
+
+    def set_many(self, keys, values):
+        """Assign values to a list of (section, name) pairs."""
+        slots = [self.slot(section, name) for section, name in keys]
+        self.values[slots] = values
+
+    def mask(self, sections=['all'], names=['all']):
+        """Boolean mask over slots for the given section types and parameter names."""
+        mask = np.ones(len(self), dtype=bool)
+        if 'all' not in sections:
+            mask &= np.isin(self.sections, sections)
+        if 'all' not in names:
+            mask &= np.isin(self.names, names)
+        return mask
+
+    def scale(self, factor, sections=['all'], names=['all']):
+        """Multiply the selected values by factor."""
+        self.values[self.mask(sections, names)] *= factor
+
+    def copy(self):
+        """Independent copy sharing no mutable state with this table."""
+        other = copy.copy(self)
+        other.values = self.values.copy()
+        return other
+
+    def to_genome(self):
+        """Genome list in the fit JSON format with the current values."""
+        genome = copy.deepcopy(self.entries)
+        for entry, value in zip(genome, self.values):
+            entry["value"] = float(value)
+        return genome
+
+    def to_fit_json(self, data, file_path=None):
+        """
+        Return a copy of the fit description data with this table's genome, optionally writing it to file_path.
+        """
+        data = copy.deepcopy(data)
+        data["genome"] = self.to_genome()
+        if file_path is not None:
+            with open(file_path, "w") as file:
+                json.dump(data, file, indent=4)
+        return data
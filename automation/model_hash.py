@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+
+def _canonical(obj):
+    """Normalize fit JSON content so that "0.0001" and 0.0001 hash the same."""
+    if isinstance(obj, dict):
+        return {key: _canonical(item) for key, item in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(item) for item in obj]
+    if isinstance(obj, str):
+        try:
+            return float(obj)
+        except ValueError:
+            return obj
+    if isinstance(obj, int) and not isinstance(obj, bool):
+        return float(obj)
+    return obj
+
+def hash_json(obj):
+    """Return the sha256 hex digest of a canonical JSON encoding of obj."""
+    encoded = json.dumps(_canonical(obj), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def hash_file(path):
+    """Return the sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def hash_modfiles(modfile_dir):
+    """Return the sha256 hex digest of the set of .mod files in modfile_dir (names and contents)."""
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(modfile_dir)):
+        if not name.endswith(".mod"):
+            continue
+        digest.update(name.encode("utf-8"))
+        digest.update(hash_file(os.path.join(modfile_dir, name)).encode("utf-8"))
+    return digest.hexdigest()
+
+def hash_model(data, morphology_path, modfile_dir, extra=None):
+    """
+    Return a key identifying a built cell.
+
+    Parameters:
+      data           : the fit description (utils.description.data); its genome,
+                       passive and conditions blocks are hashed
+      morphology_path: path to the SWC file
+      modfile_dir    : directory holding the compiled .mod files
+      extra          : optional JSON-serializable changes made after building,
+                       e.g. {"soma_diam_scale": 2}
+    """
+    digest = hashlib.sha256()
+    digest.update(hash_json({block: data.get(block) for block in ("genome", "passive", "conditions")}).encode("utf-8"))
+    digest.update(hash_file(morphology_path).encode("utf-8"))
+    digest.update(hash_modfiles(modfile_dir).encode("utf-8"))
+    if extra is not None:
+        digest.update(hash_json(extra).encode("utf-8"))
+    return digest.hexdigest()
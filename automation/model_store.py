@@ -0,0 +1,354 @@
+# Local, content-addressed store of Allen biophysical models, and a stand-in for the Allen API.
+#
+# example use:
+#   python -m automation.model_store fetch 488683425 488697163        # download once into the store
+#   python -m automation.model_store checkout 488683425 cells/488683425
+#   python -m automation.model_store serve --port 8000                  # on the air-gapped side
+#   ALLEN_API_BASE_URI=http://localhost:8000 python -m automation.download_from_allen_and_tune_r_in 488683425
+#
+# Store layout (root defaults to $ALLEN_MODEL_STORE or ~/.cache/single-cell-tuning/models):
+#   objects/<sha256[:2]>/<sha256>   file contents, written once; identical files (e.g. modfiles
+#                                   shared by many cells) are stored once
+#   models/<specimen_id>.json       the files of a cache_data working directory by relative path
+#   well_known_files/<id>           sha256 of the Allen well known file with that id
+#   rma/<sha256 of query>.json      recorded responses of the Allen RMA queries
+#
+# The store directory can be copied to compute nodes as is. Its recorded queries and files let
+# serve() answer the requests BiophysicalApi makes (/api/v2/data/query.json and
+# /api/v2/well_known_file_download/<id>) without network access.
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+def default_store_dir():
+    """Store location: $ALLEN_MODEL_STORE or ~/.cache/single-cell-tuning/models."""
+    return os.environ.get("ALLEN_MODEL_STORE",
+                          os.path.join(os.path.expanduser("~"), ".cache", "single-cell-tuning", "models"))
+
+def default_base_uri():
+    """Allen API host: $ALLEN_API_BASE_URI (e.g. a stand-in started with serve) or allensdk's default."""
+    return os.environ.get("ALLEN_API_BASE_URI")
+
+def query_key(url):
+    """Key of an RMA query URL: its decoded path and query string, without the host."""
+    parts = urlsplit(url)
+    return unquote(parts.path + ("?" + parts.query if parts.query else ""))
+
+# read once at import (os.umask can only be read by setting it, which is not thread-safe)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def _make_shareable(path):
+    """Give a mkstemp file (mode 0600) the mode a plainly created file would have, so a shared store stays readable."""
+    os.chmod(path, 0o644 & ~_UMASK)
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def _write_atomic(path, data):
+    """Write data to path through a temporary file so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        _make_shareable(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+def _recording_api(base_uri, responses):
+    """A BiophysicalApi that also records every parsed JSON response into responses."""
+    # imported here so the store (and serve) work without allensdk
+    from allensdk.api.queries.biophysical_api import BiophysicalApi
+
+    class RecordingBiophysicalApi(BiophysicalApi):
+        def retrieve_parsed_json_over_http(self, url, *args, **kwargs):
+            data = super().retrieve_parsed_json_over_http(url, *args, **kwargs)
+            responses[query_key(url)] = data
+            return data
+
+    return RecordingBiophysicalApi(base_uri) if base_uri else RecordingBiophysicalApi()
+
+class ModelStore:
+    def __init__(self, root=None):
+        """
+        Content-addressed store of downloaded Allen biophysical models (see module comment).
+
+        Parameters:
+          root: store directory (defaults to default_store_dir())
+        """
+        self.root = root or default_store_dir()
+        for name in ["objects", "models", "well_known_files", "rma"]:
+            os.makedirs(os.path.join(self.root, name), exist_ok=True)
+
+    # objects
+
+    def object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def put_bytes(self, data):
+        """Store data. Returns its sha256; contents already in the store are not written again."""
+        digest = hash_bytes(data)
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            _write_atomic(path, data)
+        return digest
+
+    def put_verified(self, path, digest):
+        """Move a file whose sha256 the caller has computed into the store. Returns digest."""
+        target = self.object_path(digest)
+        if os.path.exists(target):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            _make_shareable(path)
+            os.replace(path, target)
+        return digest
+
+    def put_file(self, path):
+        with open(path, "rb") as file:
+            return self.put_bytes(file.read())
+
+    def get_bytes(self, digest):
+        with open(self.object_path(digest), "rb") as file:
+            data = file.read()
+        if hash_bytes(data) != digest:
+            raise ValueError(f"Corrupt object {digest} in {self.root}")
+        return data
+
+    # models
+
+    def model_path(self, specimen_id):
+        return os.path.join(self.root, "models", f"{specimen_id}.json")
+
+    def get_model(self, specimen_id):
+        """Record of a stored model, or None if specimen_id has not been stored."""
+        path = self.model_path(specimen_id)
+        if not os.path.exists(path):
+            return None
+        with open(path) as file:
+            return json.load(file)
+
+    def put_model(self, specimen_id, neuronal_model_id, working_directory, well_known_files=None, stimulus=False):
+        """
+        Store every file of a cache_data working directory.
+
+        Parameters:
+          specimen_id      : Allen cell types specimen id
+          neuronal_model_id: id of the neuronal model the files were downloaded for
+          working_directory: directory cache_data wrote to (nothing else should be in it)
+          well_known_files : optional {well known file id: relative path} of the downloaded files
+          stimulus         : whether the stimulus NWB file was downloaded
+
+        Returns:
+          the model record
+        """
+        files = {}
+        dirs = []
+        for directory, subdirs, names in os.walk(working_directory):
+            rel_dir = os.path.relpath(directory, working_directory)
+            if rel_dir != "." and not names and not subdirs:
+                dirs.append(rel_dir)
+            for name in names:
+                rel_path = os.path.normpath(os.path.join(rel_dir, name))
+                files[rel_path] = self.put_file(os.path.join(directory, name))
+
+        wkf_digests = {}
+        for wkf_id, rel_path in (well_known_files or {}).items():
+            rel_path = os.path.normpath(rel_path)
+            if rel_path in files:
+                wkf_digests[str(wkf_id)] = files[rel_path]
+                self.put_well_known_file(wkf_id, files[rel_path])
+
+        return self.put_record(specimen_id, neuronal_model_id, files, dirs, wkf_digests, stimulus)
+
+    def put_record(self, specimen_id, neuronal_model_id, files, dirs=(), well_known_files=None, stimulus=False):
+        """
+        Write the record of a model whose files are already in the store.
+
+        Parameters:
+          files           : {relative path: sha256}
+          dirs            : relative paths of empty directories to create on checkout
+          well_known_files: {well known file id: sha256}
+        """
+        record = {"specimen_id": specimen_id,
+                  "neuronal_model_id": neuronal_model_id,
+                  "stimulus": stimulus,
+                  "files": files,
+                  "dirs": sorted(dirs),
+                  "well_known_files": {str(wkf_id): digest for wkf_id, digest in (well_known_files or {}).items()}}
+        _write_atomic(self.model_path(specimen_id), json.dumps(record, indent=2).encode("utf-8"))
+        return record
+
+    def checkout(self, specimen_id, working_directory="."):
+        """
+        Write a stored model's files into working_directory (as cache_data would have).
+
+        Returns:
+          the model record, or None if specimen_id has not been stored
+        """
+        record = self.get_model(specimen_id)
+        if record is None:
+            return None
+        for rel_dir in record["dirs"]:
+            os.makedirs(os.path.join(working_directory, rel_dir), exist_ok=True)
+        for rel_path, digest in record["files"].items():
+            target = os.path.join(working_directory, rel_path)
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            # copies rather than links, so edits in the working directory cannot reach the store
+            shutil.copyfile(self.object_path(digest), target)
+        return record
+
+    # recorded queries and well known files (used by serve)
+
+    def put_responses(self, responses):
+        for key, data in responses.items():
+            path = os.path.join(self.root, "rma", hash_bytes(key.encode("utf-8")) + ".json")
+            _write_atomic(path, json.dumps({"query": key, "response": data}).encode("utf-8"))
+
+    def get_response(self, url):
+        """Recorded parsed JSON response of an RMA query URL (with or without host), or None."""
+        path = os.path.join(self.root, "rma", hash_bytes(query_key(url).encode("utf-8")) + ".json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as file:
+            return json.load(file)["response"]
+
+    def put_well_known_file(self, wkf_id, digest):
+        """Record that the Allen well known file wkf_id has contents digest."""
+        _write_atomic(os.path.join(self.root, "well_known_files", str(wkf_id)), digest.encode("utf-8"))
+
+    def well_known_file_digest(self, wkf_id):
+        """sha256 of a stored well known file, or None if it has not been stored."""
+        path = os.path.join(self.root, "well_known_files", str(wkf_id))
+        if not os.path.exists(path):
+            return None
+        with open(path) as file:
+            return file.read().strip()
+
+    def get_well_known_file(self, wkf_id):
+        """Contents of the Allen well known file with id wkf_id, or None if not stored."""
+        digest = self.well_known_file_digest(wkf_id)
+        return None if digest is None else self.get_bytes(digest)
+
+    # downloads
+
+    def fetch(self, specimen_id, working_directory=None, cache_stimulus=False, base_uri=None):
+        """
+        Make sure the model for specimen_id is in the store, downloading it with BiophysicalApi
+        only if it is not, and optionally check it out into working_directory.
+
+        Parameters:
+          specimen_id      : Allen cell types specimen id
+          working_directory: directory to write the model files to (None to only fill the store)
+          cache_stimulus   : also download the (large) stimulus NWB file
+          base_uri         : Allen API host (defaults to default_base_uri())
+
+        Returns:
+          the model record
+        """
+        record = self.get_model(specimen_id)
+        if record is None or (cache_stimulus and not record["stimulus"]):
+            record = self.download(specimen_id, cache_stimulus, base_uri)
+        else:
+            print(f"cell {specimen_id} found in model store {self.root}")
+        if working_directory is not None:
+            self.checkout(specimen_id, working_directory)
+        return record
+
+    def download(self, specimen_id, cache_stimulus=False, base_uri=None):
+        """Download the model for specimen_id into the store, recording the API responses."""
+        responses = {}
+        bp = _recording_api(base_uri or default_base_uri(), responses)
+        query = bp.get_neuronal_models(specimen_id)
+        neuronal_model_id = query[0]['id']
+
+        bp.cache_stimulus = cache_stimulus
+        download_dir = tempfile.mkdtemp(prefix=f".download-{specimen_id}-", dir=self.root)
+        try:
+            bp.cache_data(neuronal_model_id, working_directory=download_dir)
+            well_known_files = {wkf_id: filename
+                                for id_dict in bp.ids.values()
+                                for wkf_id, filename in id_dict.items()}
+            record = self.put_model(specimen_id, neuronal_model_id, download_dir, well_known_files, cache_stimulus)
+            self.put_responses(responses)
+        finally:
+            shutil.rmtree(download_dir, ignore_errors=True)
+        print(f"stored cell {specimen_id} (model {neuronal_model_id}) in {self.root}")
+        return record
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    store = None  # set by serve
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path.startswith("/api/v2/well_known_file_download/"):
+            data = self.store.get_well_known_file(path.rsplit("/", 1)[-1])
+            content_type = "application/octet-stream"
+        elif path.startswith("/api/v2/data/"):
+            response = self.store.get_response(self.path)
+            data = None if response is None else json.dumps(response).encode("utf-8")
+            content_type = "application/json"
+        else:
+            data = None
+
+        if data is None:
+            self.send_error(404, "Not in the local model store; fetch it on a machine with network access first")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def serve(store, host="127.0.0.1", port=8000):
+    """Serve the store's recorded queries and files on the Allen API endpoints until interrupted."""
+    handler = type("StandInHandler", (_StandInHandler,), {"store": store})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"serving {store.root} on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main(argv=None):
+    # imported here so that importing this module does not need the tuning script's dependencies
+    from automation.download_from_allen_and_tune_r_in import robust_int_conversion
+
+    parser = argparse.ArgumentParser(description="Local Allen biophysical model store.")
+    parser.add_argument("--root", default=None, help="store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fetch = commands.add_parser("fetch", help="download cells into the store")
+    fetch.add_argument("cells", nargs="+", help="specimen ids or cell types URLs")
+    fetch.add_argument("--stimulus", action="store_true", help="also store the stimulus NWB files")
+    checkout = commands.add_parser("checkout", help="write a stored cell into a directory")
+    checkout.add_argument("cell")
+    checkout.add_argument("directory", nargs="?", default=".")
+    server = commands.add_parser("serve", help="serve the store on the Allen API endpoints")
+    server.add_argument("--host", default="127.0.0.1")
+    server.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args(argv)
+
+    store = ModelStore(args.root)
+    if args.command == "fetch":
+        for cell in args.cells:
+            store.fetch(robust_int_conversion(cell), cache_stimulus=args.stimulus)
+    elif args.command == "checkout":
+        specimen_id = robust_int_conversion(args.cell)
+        if store.checkout(specimen_id, args.directory) is None:
+            raise SystemExit(f"cell {specimen_id} is not in {store.root}")
+    else:
+        serve(store, args.host, args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import copy
+
+import numpy as np
+
+from automation.cell_builder import section_type
+
+class DeltaApplier:
+    def __init__(self, h, table, passive, rest_state_cache=None):
+        """
+        Apply only the genome and passive values that changed since the last apply.
+
+        Assumes the cell was fully built once (utils.load_cell_parameters) with the
+        table's current values and the given passive block. After that, edit the
+        GenomeTable (set, set_many, scale, ...) or call set_passive, then apply() writes
+        just the changed RANGE variables (e.g. sec.gbar_NaTa, sec.g_pas) to the
+        affected sections instead of rebuilding the whole cell.
+
+        Parameters:
+          h               : the NEURON h object holding the built cell
+          table           : GenomeTable for the cell's genome
+          passive         : the fit's passive block, utils.description.data["passive"][0]
+          rest_state_cache: optional RestStateCache told about every apply() that changes the cell
+        """
+        self.h = h
+        self.table = table
+        self.passive = copy.deepcopy(passive)
+        self.rest_state_cache = rest_state_cache
+        self.applied_values = table.values.copy()
+        self.applied_passive = copy.deepcopy(passive)
+        self.sections = {}
+        for sec in h.allsec():
+            self.sections.setdefault(section_type(sec), []).append(sec)
+
+    def set_passive(self, key, value, section=None):
+        """
+        Change a passive value: "ra", "e_pas", or "cm" for one section type.
+        """
+        if key == "cm":
+            for entry in self.passive["cm"]:
+                if entry["section"] == section:
+                    entry["cm"] = value
+                    return
+            raise KeyError(f"No cm entry for {section}")
+        self.passive[key] = value
+
+    def apply(self):
+        """
+        Write the changed values to the cell.
+
+        Returns:
+          the number of (section type, variable) assignments made
+        """
+        n_applied = 0
+        changed = np.flatnonzero(self.table.values != self.applied_values)
+        for slot in changed:
+            name = self.table.names[slot]
+            value = self.table.values[slot]
+            for sec in self.sections.get(self.table.sections[slot], []):
+                setattr(sec, name, value)
+            n_applied += 1
+        self.applied_values[changed] = self.table.values[changed]
+
+        if self.passive["ra"] != self.applied_passive["ra"]:
+            for sec in self.h.allsec():
+                sec.Ra = self.passive["ra"]
+            n_applied += 1
+        if self.passive["e_pas"] != self.applied_passive["e_pas"]:
+            for sec in self.h.allsec():
+                sec.e_pas = self.passive["e_pas"]
+            n_applied += 1
+        applied_cm = dict([(c['section'], c['cm']) for c in self.applied_passive['cm']])
+        for entry in self.passive["cm"]:
+            if entry["cm"] != applied_cm.get(entry["section"]):
+                for sec in self.sections.get(entry["section"], []):
+                    sec.cm = entry["cm"]
+                n_applied += 1
+        self.applied_passive = copy.deepcopy(self.passive)
+        if n_applied and self.rest_state_cache is not None:
+            self.rest_state_cache.parameters_changed()
+        return n_applied
+
+    def sync_description(self, utils):
+        """Write the applied values back into utils.description.data so a full rebuild matches the cell."""
+        utils.description.data["genome"] = self.table.to_genome()
+        utils.description.data["passive"][0] = copy.deepcopy(self.applied_passive)
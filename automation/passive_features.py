@@ -0,0 +1,74 @@
+import numpy as np
+
+def compute_passive_features(traces, dt, I_t_start, I_t_end, I_amp, t=None):
+    """
+    Compute R_in, tau1, tau2, sag ratio and RMP for one or many hyperpolarizing-step traces.
+
+    Vectorized version of the notebooks' compute_gpp: every trace is processed at once
+    with NumPy, with no Python loop over samples or traces.
+
+    Parameters:
+      traces   : voltage traces (mV), 1-D for a single trace or 2-D with one trace per row,
+                 sampled every dt starting at t = 0 (or at the times t)
+      dt       : sampling interval (ms); ignored when t is given
+      I_t_start: current injection start time (ms)
+      I_t_end  : time at which V_final is read (ms), usually a few ms before the end of the step
+      I_amp    : injected current (nA); a scalar or one value per trace
+      t        : optional sample times (ms) shared by every trace, for variable time steps
+                 (CVode); samples are then found by time instead of by index
+
+    Returns:
+      dict with "R_in" (MOhm), "tau1" (ms), "tau2" (ms), "sag" and "RMP" (mV). Values are
+      arrays with one entry per trace (floats for 1-D input). tau1/tau2 are NaN when the
+      trace never crosses the 63.2% level.
+    """
+    traces = np.asarray(traces, dtype=float)
+    single = traces.ndim == 1
+    V = np.atleast_2d(traces)
+    n_traces, n_samples = V.shape
+    rows = np.arange(n_traces)
+    samples = np.arange(n_samples)
+    I_amp = np.broadcast_to(np.asarray(I_amp, dtype=float), (n_traces,))
+
+    if t is None:
+        index_V_rest = int(I_t_start / dt) - 1
+        index_V_final = int(I_t_end / dt) - 1
+        t = samples * dt
+    else:
+        # the last samples before I_t_start and I_t_end, as with a fixed step
+        t = np.asarray(t, dtype=float)
+        index_V_rest = int(np.searchsorted(t, I_t_start)) - 1
+        index_V_final = int(np.searchsorted(t, I_t_end)) - 1
+    # If there is no h channel, V_final == V_trough
+    index_V_trough = index_V_rest + np.argmin(V[:, index_V_rest:], axis=1)
+
+    V_rest = V[:, index_V_rest]
+    V_trough = V[rows, index_V_trough]
+    V_final = V[:, index_V_final]
+
+    # R_in
+    R_in = (V_rest - V_trough) / (0 - I_amp)
+
+    # Tau1: first sample after V_rest below 63.2% of the way to the trough
+    V_tau1 = V_rest - (V_rest - V_trough) * 0.632
+    crossed = (samples >= index_V_rest) & (V < V_tau1[:, None])
+    tau1 = _first_crossing(crossed, t) - t[index_V_rest]
+
+    # Tau2: first sample after the trough above 63.2% of the way back to V_final
+    V_tau2 = V_trough - (V_trough - V_final) * 0.632
+    crossed = (samples >= index_V_trough[:, None]) & (V > V_tau2[:, None])
+    tau2 = _first_crossing(crossed, t) - t[index_V_trough]
+
+    # Sag ratio
+    sag = (V_final - V_trough) / (V_rest - V_trough)
+
+    features = {"R_in": R_in, "tau1": tau1, "tau2": tau2, "sag": sag, "RMP": V_rest}
+    if single:
+        return {name: float(values[0]) for name, values in features.items()}
+    return features
+
+def _first_crossing(crossed, t):
+    """Time of the first True in each row (NaN if there is none)."""
+    first = t[np.argmax(crossed, axis=1)].astype(float)
+    first[~crossed.any(axis=1)] = np.nan
+    return first
@@ -0,0 +1,238 @@
+# Staged pipeline that overlaps download, compile and build/simulate across a cohort of cells.
+#
+# example use:
+#   python -m automation.pipeline cells.csv --user-specs user_specifications.json --sim-workers 8
+#
+# Each cell passes through three stages connected by bounded asyncio queues:
+#   fetch    model store checkout into <work-dir>/<specimen_id>, downloading on a miss (threads)
+#   compile  nrnivmodl through the compile cache (threads; the work happens in the subprocess)
+#   tune     Config().load/Utils, generate_morphology, load_cell_parameters and the R_in tuning
+#            (spawned processes, one cell per process since the cell is built into NEURON's top level)
+# A full queue blocks the stage feeding it, so downloads and compiles run ahead of the simulations
+# by at most queue_size cells. Records are written as JSON lines like batch_tune_r_in, and
+# per-stage throughput and queue depths are reported at the end (and every report_interval s).
+
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from automation.batch_tune_r_in import _tune_cell, read_cells
+from automation.compile_cache import compiled_mechanisms
+from automation.download_from_allen_and_tune_r_in import load_dictionary_from_json
+from automation.model_store import ModelStore
+
+_DONE = None  # end of stream marker passed down the queues
+
+class StageStats:
+    def __init__(self, name):
+        """Counters for one stage. busy is the summed time its workers spent on cells (s)."""
+        self.name = name
+        self.done = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.first_start = None
+        self.last_end = None
+
+    def add(self, start, end, failed=False):
+        self.done += 1
+        self.failed += failed
+        self.busy += end - start
+        self.first_start = start if self.first_start is None else min(self.first_start, start)
+        self.last_end = end if self.last_end is None else max(self.last_end, end)
+
+    def summary(self):
+        elapsed = (self.last_end - self.first_start) if self.done else 0.0
+        throughput = self.done / elapsed if elapsed > 0 else 0.0
+        mean_time = self.busy / self.done if self.done else 0.0
+        return (f"{self.name:8} {self.done} cells ({self.failed} failed), {throughput:.3f} cells/s, "
+                f"{mean_time:.2f} s per cell")
+
+class QueueStats:
+    def __init__(self, name, queue):
+        """Samples of one queue's depth."""
+        self.name = name
+        self.queue = queue
+        self.samples = []
+
+    def sample(self):
+        self.samples.append(self.queue.qsize())
+
+    def summary(self):
+        if not self.samples:
+            return f"{self.name:16} no samples"
+        return (f"{self.name:16} depth mean {sum(self.samples) / len(self.samples):.1f}, max {max(self.samples)} "
+                f"of {self.queue.maxsize}")
+
+class _TuneJob:
+    def __init__(self, work_dir, plot):
+        """Picklable tune stage work, run in the pipeline's worker processes."""
+        self.work_dir = work_dir
+        self.plot = plot
+
+    def __call__(self, job):
+        # _tune_cell never raises; it returns a record with an error instead
+        record = _tune_cell((job["specimen_id"], job["user_specs"], self.work_dir, self.plot))
+        job = dict(job, record=record)
+        if "error" in record:
+            job["error"] = record["error"]
+        return job
+
+class TuningPipeline:
+    def __init__(self, user_specs_dict=None, work_dir="cells", store=None, fetch_workers=4, compile_workers=2,
+                 sim_workers=None, queue_size=4, plot=False, report_interval=60.0):
+        """
+        Pipeline of fetch, compile and tune stages (see module comment).
+
+        Parameters:
+          user_specs_dict : user specifications shared by all cells
+          work_dir        : directory holding one working directory per cell
+          store           : ModelStore the cells are fetched from (defaults to ModelStore())
+          fetch_workers   : cells downloaded at once
+          compile_workers : modfile sets compiled at once
+          sim_workers     : processes building and tuning cells (defaults to the CPU count)
+          queue_size      : maximum cells waiting between two stages
+          plot            : save voltage trace plots in each cell directory
+          report_interval : seconds between progress reports (None for only the final report)
+        """
+        self.user_specs_dict = user_specs_dict
+        self.work_dir = os.path.abspath(work_dir)
+        self.store = store or ModelStore()
+        self.fetch_workers = fetch_workers
+        self.compile_workers = compile_workers
+        self.sim_workers = sim_workers or os.cpu_count()
+        self.queue_size = queue_size
+        self.plot = plot
+        self.report_interval = report_interval
+        self.stages = {name: StageStats(name) for name in ["fetch", "compile", "tune"]}
+        self.queues = []
+
+    def cell_dir(self, specimen_id):
+        return os.path.join(self.work_dir, str(specimen_id))
+
+    # stage work; each takes and returns a job dict. An exception marks the job as failed and
+    # later stages pass it on untouched
+
+    def fetch(self, job):
+        self.store.fetch(job["specimen_id"], self.cell_dir(job["specimen_id"]))
+        return job
+
+    def compile(self, job):
+        compiled_mechanisms(os.path.join(self.cell_dir(job["specimen_id"]), "modfiles"))
+        return job
+
+    async def stage(self, name, work, inbox, outbox, n_workers, executor=None):
+        """Run work on every job from inbox with n_workers at once, passing jobs on to outbox."""
+        loop = asyncio.get_running_loop()
+        stats = self.stages[name]
+
+        async def worker():
+            while True:
+                job = await inbox.get()
+                if job is _DONE:
+                    # let the other workers of this stage see the marker too
+                    await inbox.put(_DONE)
+                    return
+                if "error" not in job:
+                    start = time.perf_counter()
+                    try:
+                        job = await loop.run_in_executor(executor, work, job)
+                    except Exception as e:
+                        job = dict(job, error=f"{name}: {type(e).__name__}: {e}")
+                    stats.add(start, time.perf_counter(), "error" in job)
+                await outbox.put(job)
+
+        await asyncio.gather(*[worker() for _ in range(n_workers)])
+        await outbox.put(_DONE)
+
+    async def feed(self, cells, outbox):
+        for specimen_id, overrides in cells:
+            user_specs_dict = dict(self.user_specs_dict or {}, **overrides)
+            await outbox.put({"specimen_id": specimen_id, "user_specs": user_specs_dict})
+        await outbox.put(_DONE)
+
+    async def collect(self, inbox, output):
+        records = []
+        while True:
+            job = await inbox.get()
+            if job is _DONE:
+                return records
+            record = job.get("record") or {"specimen_id": job["specimen_id"], "error": job["error"]}
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            records.append(record)
+            for queue in self.queues:
+                queue.sample()
+
+    async def monitor(self):
+        last_report = time.perf_counter()
+        while True:
+            await asyncio.sleep(1.0)
+            for queue in self.queues:
+                queue.sample()
+            if self.report_interval and time.perf_counter() - last_report >= self.report_interval:
+                self.report()
+                last_report = time.perf_counter()
+
+    def report(self):
+        for stats in self.stages.values():
+            print(stats.summary())
+        for queue in self.queues:
+            print(queue.summary())
+
+    async def run_async(self, cells, output_path):
+        queue_names = ["to fetch", "to compile", "to tune", "results"]
+        queues = [asyncio.Queue(maxsize=self.queue_size) for _ in queue_names]
+        self.queues = [QueueStats(name, queue) for name, queue in zip(queue_names, queues)]
+
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.sim_workers, mp_context=context, max_tasks_per_child=1) as processes, \
+                open(output_path, "a") as output:
+            monitor = asyncio.create_task(self.monitor())
+            _, _, _, _, records = await asyncio.gather(
+                self.feed(cells, queues[0]),
+                self.stage("fetch", self.fetch, queues[0], queues[1], self.fetch_workers),
+                self.stage("compile", self.compile, queues[1], queues[2], self.compile_workers),
+                self.stage("tune", _TuneJob(self.work_dir, self.plot), queues[2], queues[3], self.sim_workers, processes),
+                self.collect(queues[3], output))
+            monitor.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await monitor
+        return records
+
+    def run(self, cells, output_path="tune_r_in_results.jsonl"):
+        """
+        Run every (specimen_id, spec_overrides) in cells through the pipeline, appending a JSON
+        line per cell to output_path. Returns the records in completion order.
+        """
+        start = time.perf_counter()
+        records = asyncio.run(self.run_async(cells, output_path))
+        print(f"pipeline finished {len(records)} cells in {time.perf_counter() - start:.1f} s")
+        self.report()
+        return records
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download, compile and tune many cells with overlapping stages.")
+    parser.add_argument("cells", nargs="+", help="specimen ids, cell types URLs, or .txt/.csv files listing them")
+    parser.add_argument("--user-specs", help="JSON file with user specifications shared by all cells")
+    parser.add_argument("--output", default="tune_r_in_results.jsonl", help="JSON Lines file the records are appended to")
+    parser.add_argument("--work-dir", default="cells", help="directory holding one working directory per cell")
+    parser.add_argument("--store", default=None, help="model store directory")
+    parser.add_argument("--fetch-workers", type=int, default=4)
+    parser.add_argument("--compile-workers", type=int, default=2)
+    parser.add_argument("--sim-workers", type=int, default=None, help="tuning processes (defaults to the CPU count)")
+    parser.add_argument("--queue-size", type=int, default=4, help="maximum cells waiting between stages")
+    parser.add_argument("--plot", action="store_true", help="save voltage trace plots in each cell directory")
+    args = parser.parse_args(argv)
+
+    user_specs_dict = load_dictionary_from_json(args.user_specs) if args.user_specs else None
+    pipeline = TuningPipeline(user_specs_dict, args.work_dir, ModelStore(args.store), args.fetch_workers,
+                              args.compile_workers, args.sim_workers, args.queue_size, args.plot)
+    return pipeline.run(read_cells(args.cells), args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import copy
+
+import numpy as np
+
+from automation.cell_builder import apply_genome_overrides, section_type
+from automation.Simulation import detect_voltage_events, fixed_step_time
+
+# Allen-style cell template so several copies of the morphology can exist at once.
+# Import3d recreates the section arrays and appends to the all, somatic, axonal, basal and
+# apical SectionLists when instantiated into an object, so the template must declare them all.
+CELL_TEMPLATE = """
+begintemplate AllenPopulationCell
+public init, soma, dend, apic, axon, all, somatic, axonal, basal, apical
+create soma[1], dend[1], apic[1], axon[1]
+objref all, somatic, axonal, basal, apical
+proc init() {
+  all = new SectionList()
+  somatic = new SectionList()
+  axonal = new SectionList()
+  basal = new SectionList()
+  apical = new SectionList()
+}
+endtemplate AllenPopulationCell
+"""
+
+class CellPopulation:
+    def __init__(self, utils, genome_overrides, nthread=1):
+        """
+        N independent copies of an Allen cell advanced together in one NEURON instance.
+
+        Each copy gets the fit's genome with its own overrides applied, its own IClamp
+        at soma[0](0.5) and its own voltage recorder. All copies share h.t, so one
+        finitialize and one run serve the whole batch.
+
+        Parameters:
+          utils           : allensdk Utils for the fit (see cell_builder.build_cell); its
+                            description supplies the morphology, passive, conditions and genome
+          genome_overrides: one list of {"section", "name", "value"} changes per copy,
+                            the same format update_sections works with
+          nthread         : number of threads for ParallelContext.nthread. More than one
+                            requires THREADSAFE mechanisms.
+
+        The top-level cell utils built (if any) is deleted, so that only the copies are
+        simulated; utils.h holds no top-level soma afterwards.
+        """
+        self.h = utils.h
+        self.description = utils.description
+        self.cells = []
+        self.genomes = []
+        self.stims = []
+        self.v_vecs = []
+        self.t_vec = None
+
+        self.h.load_file("stdrun.hoc")
+        self.h.load_file("import3d.hoc")
+        if not self.h.name_declared("AllenPopulationCell"):
+            self.h(CELL_TEMPLATE)
+
+        # otherwise utils' cell would be integrated alongside the copies in every run
+        for sec in [sec for sec in self.h.allsec() if sec.cell() is None]:
+            self.h.delete_section(sec=sec)
+
+        morphology_path = self.description.manifest.get_path('MORPHOLOGY')
+        base_genome = self.description.data['genome']
+        for overrides in genome_overrides:
+            genome = copy.deepcopy(base_genome)
+            for entry in genome:
+                entry['value'] = float(entry['value'])
+            apply_genome_overrides(genome, overrides)
+
+            cell = self.build_morphology(morphology_path)
+            self.load_cell_parameters(cell, genome)
+            self.cells.append(cell)
+            self.genomes.append(genome)
+
+        conditions = self.description.data['conditions'][0]
+        self.h.celsius = conditions['celsius']
+        self.h.v_init = conditions['v_init']
+
+        self.pc = self.h.ParallelContext()
+        self.pc.nthread(nthread)
+
+    def build_morphology(self, morphology_path):
+        """Instantiate one copy of the morphology with the Allen stub axon."""
+        h = self.h
+        cell = h.AllenPopulationCell()
+        swc = h.Import3d_SWC_read()
+        swc.quiet = 1
+        swc.input(morphology_path)
+        imprt = h.Import3d_GUI(swc, 0)
+        imprt.instantiate(cell)
+
+        # drop template placeholders for section types the morphology does not have
+        in_all = set(sec for sec in cell.all)
+        for sec in [sec for sec in h.allsec() if sec.cell() == cell and sec not in in_all]:
+            h.delete_section(sec=sec)
+
+        for sec in cell.all:
+            sec.nseg = 1 + 2 * int(sec.L / 40)
+
+        # replace the reconstructed axon with the 60 um stub used by the Allen perisomatic models
+        for sec in [sec for sec in cell.all if section_type(sec) == "axon"]:
+            h.delete_section(sec=sec)
+        h.execute('create axon[2]', cell)
+        for sec in cell.axon:
+            sec.L = 30
+            sec.diam = 1
+            sec.nseg = 1 + 2 * int(sec.L / 40)
+            cell.all.append(sec=sec)
+            cell.axonal.append(sec=sec)
+        cell.axon[0].connect(cell.soma[0], 0.5, 0)
+        cell.axon[1].connect(cell.axon[0], 1, 0)
+        h.define_shape()
+        return cell
+
+    def load_cell_parameters(self, cell, genome):
+        """Per-copy version of Utils.load_cell_parameters restricted to cell's sections."""
+        passive = self.description.data['passive'][0]
+        conditions = self.description.data['conditions'][0]
+
+        # Set passive properties; section types without a cm entry keep NEURON's default
+        cm_dict = dict([(c['section'], c['cm']) for c in passive['cm']])
+        for sec in cell.all:
+            sec.Ra = passive['ra']
+            cm = cm_dict.get(section_type(sec))
+            if cm is not None:
+                sec.cm = cm
+            sec.insert('pas')
+            for seg in sec:
+                seg.pas.e = passive["e_pas"]
+
+        # Insert channels and set parameters
+        for p in genome:
+            for sec in [s for s in cell.all if section_type(s) == p["section"]]:
+                if p["mechanism"] != "":
+                    sec.insert(p["mechanism"])
+                setattr(sec, p["name"], p["value"])
+
+        # Set reversal potentials
+        for erev in conditions['erev']:
+            for sec in [s for s in cell.all if section_type(s) == erev["section"]]:
+                sec.ena = erev["ena"]
+                sec.ek = erev["ek"]
+
+    def setup_stimulation(self, amps, delay, dur):
+        """One IClamp per copy. amps is a single amplitude or one per copy (nA)."""
+        amps = np.broadcast_to(np.asarray(amps, dtype=float), (len(self.cells),))
+        self.stims = []
+        for cell, amp in zip(self.cells, amps):
+            stim = self.h.IClamp(cell.soma[0](0.5))
+            stim.amp = amp
+            stim.delay = delay
+            stim.dur = dur
+            self.stims.append(stim)
+
+    def setup_recording(self):
+        """Record each copy's somatic voltage, and the shared time if CVode is active."""
+        self.t_vec = None
+        if self.h.cvode.active():
+            self.t_vec = self.h.Vector()
+            self.t_vec.record(self.h._ref_t)
+        self.v_vecs = []
+        for cell in self.cells:
+            v_vec = self.h.Vector()
+            v_vec.record(cell.soma[0](0.5)._ref_v)
+            self.v_vecs.append(v_vec)
+
+    def run(self, amps, delay=100.0, dur=800.0, tstop=1000.0):
+        """
+        Stimulate every copy and advance them together.
+
+        Returns:
+          t : NumPy array of time points (ms)
+          v : 2-D NumPy array of somatic voltages, one row per copy (mV)
+        """
+        self.setup_stimulation(amps, delay, dur)
+        self.setup_recording()
+        self.h.tstop = tstop
+        self.h.run()
+        # one copy of each voltage trace, straight from views of the vectors into the result
+        v = np.stack([v_vec.as_numpy() for v_vec in self.v_vecs])
+        t = np.array(self.t_vec) if self.t_vec is not None else fixed_step_time(v.shape[1], self.h.dt)
+        return t, v
+
+    def measure_r_in(self, stim_amp=-1.0, stim_delay=100.0, stim_dur=800.0, tstop=1000.0):
+        """
+        Input resistance (MOhm) of every copy, computed as in RInSimulation.measure_r_in_transient.
+        """
+        t, v = self.run(stim_amp, stim_delay, stim_dur, tstop)
+        dt = self.h.dt
+        V_rest = v[:, int(stim_delay / dt) - 1]
+        V_trough = v[:, int((stim_delay + stim_dur) / dt) - 1]
+        return (V_rest - V_trough) / - stim_amp
+
+    def spike_times(self, t, v, threshold=-20.0):
+        """Spike times (ms) of every copy from the traces returned by run()."""
+        return [detect_voltage_events(t, row, threshold) for row in v]
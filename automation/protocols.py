@@ -0,0 +1,164 @@
+import numpy as np
+
+from automation.passive_features import compute_passive_features
+from automation.Simulation import fixed_step_time
+
+class StepProtocol:
+    def __init__(self, baseline=300.0):
+        """
+        Several current steps concatenated into one IClamp waveform.
+
+        The amplitude is driven with Vector.play, so a single finitialize and a single
+        settling period (baseline) serve every step. The recorded trace is split back
+        into one window per step for feature extraction.
+
+        Parameters:
+          baseline: time before the first step (ms); the cell settles here and RMP is read at its end
+        """
+        self.baseline = baseline
+        self.steps = []   # dicts with name, amp (nA), start and end (ms)
+        self.end = baseline
+        self.stim = None
+        self.t_play = None
+        self.i_play = None
+
+    def add_step(self, name, amp, dur, gap_after=0.0):
+        """Append a step of amp (nA) lasting dur (ms), followed by gap_after ms at 0 nA."""
+        start = self.end
+        self.steps.append({"name": name, "amp": amp, "start": start, "end": start + dur})
+        self.end = start + dur + gap_after
+        return self
+
+    @classmethod
+    def passive_and_firing(cls, hyperpol_amp=-0.2, hyperpol_dur=400.0, recovery=300.0,
+                           depol_amps=(0.05, 0.1, 0.15, 0.2, 0.25, 0.3), depol_dur=400.0, gap=300.0,
+                           baseline=300.0):
+        """Hyperpolarizing step, a recovery gap, then a series of depolarizing steps."""
+        protocol = cls(baseline)
+        protocol.add_step("hyperpolarizing", hyperpol_amp, hyperpol_dur, recovery)
+        for amp in depol_amps:
+            protocol.add_step(f"depolarizing {amp * 1000:.0f} pA", amp, depol_dur, gap)
+        return protocol
+
+    @property
+    def tstop(self):
+        return self.end
+
+    def waveform(self):
+        """
+        Breakpoints of the piecewise-constant waveform.
+
+        Returns:
+          t (ms) and amplitude (nA) arrays; each step edge appears twice so linear
+          interpolation between breakpoints reproduces the steps exactly.
+        """
+        t = [0.0]
+        amp = [0.0]
+        for step in self.steps:
+            t += [step["start"], step["start"], step["end"], step["end"]]
+            amp += [0.0, step["amp"], step["amp"], 0.0]
+        t.append(self.end)
+        amp.append(0.0)
+        return np.array(t), np.array(amp)
+
+    def setup(self, h, seg=None):
+        """Create the IClamp (soma[0](0.5) by default) and play the waveform into its amplitude."""
+        seg = seg if seg is not None else h.soma[0](0.5)
+        self.stim = h.IClamp(seg)
+        self.stim.delay = 0
+        self.stim.dur = 1e9
+        t, amp = self.waveform()
+        self.t_play = h.Vector(t)
+        self.i_play = h.Vector(amp)
+        self.i_play.play(self.stim._ref_amp, self.t_play, True)
+        h.tstop = self.tstop
+        return self.stim
+
+    def window(self, name, pre=None, post=0.0):
+        """(start, end) times (ms) of a step's analysis window, with pre ms before the step."""
+        index = [step["name"] for step in self.steps].index(name)
+        step = self.steps[index]
+        if pre is None:
+            # the gap before the step (the baseline for the first step)
+            pre = step["start"] - (self.steps[index - 1]["end"] if index > 0 else 0.0)
+        return step["start"] - pre, step["end"] + post
+
+    def split(self, t, v, pre=None, post=0.0):
+        """
+        Split a recorded trace into per-step windows.
+
+        Returns:
+          dict of step name -> (t, v) arrays, with t shifted so the window starts at 0
+        """
+        windows = {}
+        for step in self.steps:
+            start, end = self.window(step["name"], pre, post)
+            i0, i1 = np.searchsorted(t, [start, end])
+            windows[step["name"]] = (t[i0:i1] - t[i0], v[i0:i1])
+        return windows
+
+    def extract_features(self, t, v, dt, spike_times=None, passive_step="hyperpolarizing", final_offset=5.0):
+        """
+        Features from one recorded run.
+
+        Parameters:
+          t, v        : recorded time (ms) and somatic voltage (mV)
+          dt          : sampling interval (ms), or None for variable time steps (CVode), where
+                        the passive features are read at the recorded times t
+          spike_times : optional spike times (ms) for the firing rates of the other steps
+          passive_step: name of the step used for R_in, tau and sag
+          final_offset: V_final is read this long before the end of the passive step (ms)
+
+        Returns:
+          dict with RMP, R_in, tau1, tau2, sag and, if spike_times is given, "firing_rates"
+          mapping each depolarizing step name to its rate (Hz)
+        """
+        windows = self.split(t, v)
+        start, _ = self.window(passive_step)
+        step = self.steps[[s["name"] for s in self.steps].index(passive_step)]
+        t_window, v_window = windows[passive_step]
+        if dt is None:
+            # window times measured from start, like the step times below
+            t_window = t_window + (t[np.searchsorted(t, start)] - start)
+        features = compute_passive_features(v_window, dt, step["start"] - start,
+                                            step["end"] - start - final_offset, step["amp"],
+                                            t=t_window if dt is None else None)
+
+        if spike_times is not None:
+            spike_times = np.asarray(spike_times)
+            features["firing_rates"] = {}
+            for s in self.steps:
+                if s["name"] == passive_step:
+                    continue
+                n_spikes = np.count_nonzero((spike_times >= s["start"]) & (spike_times < s["end"]))
+                features["firing_rates"][s["name"]] = float(n_spikes / ((s["end"] - s["start"]) / 1000))
+        return features
+
+    def run(self, h, seg=None, spike_threshold=-20.0):
+        """
+        Simulate the whole schedule once and extract every feature.
+
+        Returns:
+          the extract_features dict, with t and v from the run under "t" and "v"
+        """
+        seg = seg if seg is not None else h.soma[0](0.5)
+        self.setup(h, seg)
+        # time is only recorded under CVode; with a fixed step it follows from dt
+        t_vec = h.Vector().record(h._ref_t) if h.cvode.active() else None
+        v_vec = h.Vector()
+        spike_vec = h.Vector()
+        v_vec.record(seg._ref_v)
+        spike_detector = h.NetCon(seg._ref_v, None, sec=seg.sec)
+        spike_detector.threshold = spike_threshold
+        spike_detector.record(spike_vec)
+
+        h.finitialize()
+        h.run()
+
+        # v is returned, so it is copied out of the vector (which is freed with this frame)
+        v = np.array(v_vec)
+        t = np.array(t_vec) if t_vec is not None else fixed_step_time(len(v), h.dt)
+        features = self.extract_features(t, v, h.dt if t_vec is None else None, np.array(spike_vec))
+        features["t"] = t
+        features["v"] = v
+        return features
@@ -0,0 +1,123 @@
+import math
+
+from automation.cell_builder import section_type
+from automation.result_cache import result_key
+
+class RInTuner:
+    def __init__(self, h, r_in_sim, target_r_in, sections=['soma'], tolerance=1.0, max_evals=12,
+                 r_in_method="transient", g_pas_bounds=(1e-8, 1e-1), result_cache=None, model_key=None):
+        """
+        Closed-loop tuning of g_pas to hit a target input resistance.
+
+        R_in falls monotonically with g_pas and is close to a power law in it, so the
+        root of log(R_in(g_pas)) - log(target) is found with secant steps in log-log
+        space. Once the target is bracketed, steps that leave the bracket are replaced
+        by bisection.
+
+        Parameters:
+          h           : the NEURON h object holding the built cell
+          r_in_sim    : RInSimulation used for each evaluation
+          target_r_in : desired input resistance (MOhm), e.g. user_specs_dict['R-in']
+          sections    : section types whose g_pas is tuned, e.g. ['soma'] or ['all']
+          tolerance   : stop when |percent error| is below this
+          max_evals   : maximum number of R_in measurements
+          r_in_method : "transient" or "impedance" (see RInSimulation.measure_r_in)
+          g_pas_bounds: smallest and largest g_pas tried (S / cm2)
+          result_cache: optional ResultCache; evaluations already measured for this model,
+                        protocol and g_pas are read from it instead of simulated
+          model_key   : key of the built cell before tuning (see model_hash.hash_model);
+                        required with result_cache
+        """
+        if result_cache is not None and model_key is None:
+            raise ValueError("A model_key is required to use a result_cache.")
+        self.h = h
+        self.r_in_sim = r_in_sim
+        self.target_r_in = target_r_in
+        self.sections = sections
+        self.tolerance = tolerance
+        self.max_evals = max_evals
+        self.r_in_method = r_in_method
+        self.g_pas_bounds = g_pas_bounds
+        self.result_cache = result_cache
+        self.model_key = model_key
+        self.log = []  # one dict per evaluation
+
+    def set_g_pas(self, g_pas):
+        """Assign g_pas to every segment of the tuned section types."""
+        for sec in self.h.allsec():
+            if (section_type(sec) in self.sections) or ('all' in self.sections):
+                sec.g_pas = g_pas
+        if self.r_in_sim.rest_state_cache is not None:
+            self.r_in_sim.rest_state_cache.parameters_changed()
+
+    def measure(self, g_pas):
+        """R_in (MOhm) with g_pas assigned, from the result cache when it has this evaluation."""
+        if self.result_cache is None:
+            return self.r_in_sim.measure_r_in(self.r_in_method)
+        # the tuned g_pas is part of the key, since model_key describes the cell before tuning
+        protocol = dict(self.r_in_sim.protocol(self.r_in_method), g_pas=g_pas, g_pas_sections=self.sections)
+        key = result_key(self.model_key, protocol)
+        features = self.result_cache.get_or_compute(
+            key, lambda: {"r_in": float(self.r_in_sim.measure_r_in(self.r_in_method))})
+        return features["r_in"]
+
+    def evaluate(self, g_pas):
+        """Measure R_in at g_pas and record it in the evaluation log."""
+        self.set_g_pas(g_pas)
+        r_in = self.measure(g_pas)
+        percent_error = ((r_in - self.target_r_in) / self.target_r_in) * 100
+        self.log.append({"eval": len(self.log) + 1, "g_pas": g_pas, "r_in": r_in, "percent_error": percent_error})
+        print(f"eval {len(self.log)}: g_pas {g_pas:.5} S / cm2 -> r_in {r_in:.5} MOhm ({percent_error:.3}%)")
+        return r_in
+
+    @property
+    def best(self):
+        """Log entry with the smallest |percent error|."""
+        return min(self.log, key=lambda entry: abs(entry["percent_error"]))
+
+    def clip(self, g_pas):
+        return min(max(g_pas, self.g_pas_bounds[0]), self.g_pas_bounds[1])
+
+    def tune(self, g_pas_estimate):
+        """
+        Tune g_pas starting from an estimate (e.g. estimate_gbar_leak_for_user_spec_rin).
+
+        Returns:
+          the best g_pas found; it is left assigned on the cell. See self.log for every evaluation.
+        """
+        log_target = math.log(self.target_r_in)
+
+        def residual(x):
+            return math.log(self.evaluate(math.exp(x))) - log_target
+
+        x0 = math.log(self.clip(g_pas_estimate))
+        f0 = residual(x0)
+        # first step assumes R_in is proportional to 1 / g_pas
+        x1 = math.log(self.clip(math.exp(x0 + f0)))
+        f1 = residual(x1) if x1 != x0 and abs(self.best["percent_error"]) > self.tolerance else f0
+
+        bracket = None
+        while abs(self.best["percent_error"]) > self.tolerance and len(self.log) < self.max_evals:
+            if f0 * f1 < 0:
+                bracket = (x0, x1) if x0 < x1 else (x1, x0)
+            if f1 == f0:
+                break
+            x2 = x1 - f1 * (x1 - x0) / (f1 - f0)
+            if bracket is not None and not (bracket[0] < x2 < bracket[1]):
+                x2 = 0.5 * (bracket[0] + bracket[1])
+            x2 = math.log(self.clip(math.exp(x2)))
+            if x2 == x1:
+                break  # stuck at a bound
+            f2 = residual(x2)
+            if bracket is not None:
+                # keep the pair of points that still brackets the root
+                x0, f0 = (x1, f1) if f1 * f2 < 0 else (x0, f0)
+            else:
+                x0, f0 = x1, f1
+            x1, f1 = x2, f2
+
+        best = self.best
+        self.set_g_pas(best["g_pas"])
+        print(f"tuned g_pas {best['g_pas']:.5} S / cm2 -> r_in {best['r_in']:.5} MOhm "
+              f"({best['percent_error']:.3}%) in {len(self.log)} evaluations")
+        return best["g_pas"]
@@ -0,0 +1,170 @@
+# Writes table-driven copies of channel modfiles.
+#
+# example use:
+#   python -m automation.rate_tables "allen modfiles" "allen modfiles tabulated" --vmin -100 --vmax 100 --resolution 400
+#
+# Every mechanism whose rates() depends only on voltage gets a
+#   TABLE <rate variables> DEPEND celsius, <kinetic parameters> FROM vmin TO vmax WITH resolution
+# statement, so the rates are looked up and interpolated instead of recomputed at every
+# segment and timestep. Tables are rebuilt automatically when celsius (set from the fit's
+# conditions) or a listed kinetic parameter changes. Voltages outside [vmin, vmax] use the
+# end values of the table. Mechanisms whose rates depend on something else (SK on cai) and
+# mechanisms without rates() (CaDynamics) are copied unchanged.
+#
+# The analytic rates stay available in the compiled tabulated set: set h.usetable_<suffix> = 0
+# (see set_rate_tables).
+
+import argparse
+import os
+import re
+import shutil
+
+def _block(text, name):
+    """Return the body of a top-level block such as PARAMETER or NEURON ('' if absent)."""
+    match = re.search(r"^\s*" + name + r"\s*\{", text, re.M)
+    if match is None:
+        return ""
+    end = _matching_brace(text, match.end() - 1)
+    return text[match.end():end]
+
+def _matching_brace(text, open_index):
+    depth = 0
+    for index in range(open_index, len(text)):
+        if text[index] == "{":
+            depth += 1
+        elif text[index] == "}":
+            depth -= 1
+            if depth == 0:
+                return index
+    raise ValueError("unbalanced braces")
+
+def _strip_comments(text):
+    return re.sub(r":[^\n]*", "", text)
+
+def _declared_names(block):
+    """First identifier on each line of a PARAMETER/ASSIGNED block."""
+    names = []
+    for line in _strip_comments(block).splitlines():
+        match = re.match(r"\s*([A-Za-z_]\w*)", line)
+        if match:
+            names.append(match.group(1))
+    return names
+
+def tabulate_modfile(text, vmin=-100, vmax=100, resolution=200):
+    """
+    Add a TABLE statement to the rates() procedure of one modfile.
+
+    Returns:
+      the modified modfile text, or None if the mechanism's rates() cannot be tabulated over voltage
+    """
+    header = re.search(r"PROCEDURE\s+rates\s*\(((?:[^()]|\([^()]*\))*)\)\s*\{", text)
+    if header is None:
+        return None
+    argument = header.group(1).strip()
+    if argument and not re.match(r"v\s*(\(\s*mV\s*\))?$", argument):
+        return None  # rates() is indexed by something other than voltage
+
+    neuron_block = _strip_comments(_block(text, "NEURON"))
+    range_names = set()
+    for match in re.finditer(r"\bRANGE\b([^\n]*)", neuron_block):
+        range_names.update(re.findall(r"[A-Za-z_]\w*", match.group(1)))
+    assigned = set(_declared_names(_block(text, "ASSIGNED")))
+    parameters = set(_declared_names(_block(text, "PARAMETER"))) - range_names - {"v", "celsius"}
+
+    body_start = header.end()
+    body_end = _matching_brace(text, body_start - 1)
+    body = _strip_comments(text[body_start:body_end])
+
+    local_match = re.search(r"^\s*LOCAL\s+([^\n]*)\n", text[body_start:body_end], re.M)
+    locals_ = set(re.findall(r"[A-Za-z_]\w*", local_match.group(1))) if local_match else set()
+
+    table_vars = []
+    for name in re.findall(r"^\s*([A-Za-z_]\w*)\s*=", body, re.M):
+        if name in assigned and name not in range_names and name not in locals_ \
+                and name != "v" and name not in table_vars:
+            table_vars.append(name)
+    if not table_vars:
+        return None
+
+    used = set(re.findall(r"[A-Za-z_]\w*", body))
+    depend = [name for name in ["celsius"] + sorted(parameters) if name in used]
+
+    statement = f"TABLE {', '.join(table_vars)}"
+    if depend:
+        statement += f" DEPEND {', '.join(depend)}"
+    statement += f" FROM {vmin} TO {vmax} WITH {int(resolution)}"
+
+    # TABLE goes after LOCAL (if any) as the first statement of the procedure, with the
+    # file's own line ending so CRLF modfiles stay CRLF
+    newline = "\r\n" if "\r\n" in text else "\n"
+    if local_match:
+        insert_at = body_start + local_match.end()
+        new_text = text[:insert_at] + "  " + statement + newline + text[insert_at:]
+    else:
+        insert_at = body_start
+        new_text = text[:insert_at] + newline + "  " + statement + text[insert_at:]
+
+    # the tabulated procedure takes voltage as its argument
+    new_text = re.sub(r"PROCEDURE\s+rates\s*\(\s*\)", "PROCEDURE rates(v (mV))", new_text)
+    new_text = re.sub(r"\brates\s*\(\s*\)", "rates(v)", new_text)
+    return new_text
+
+def write_tabulated_modfiles(src_dir, dst_dir, vmin=-100, vmax=100, resolution=200):
+    """
+    Copy every .mod file from src_dir to dst_dir, tabulating rates() where possible.
+
+    Returns:
+      list of the SUFFIX names of the tabulated mechanisms
+    """
+    os.makedirs(dst_dir, exist_ok=True)
+    tabulated = []
+    for name in sorted(os.listdir(src_dir)):
+        if not name.endswith(".mod"):
+            continue
+        # newline="" keeps the line endings as they are in the source (several modfiles are CRLF)
+        with open(os.path.join(src_dir, name), "r", newline="") as file:
+            text = file.read()
+        new_text = tabulate_modfile(text, vmin, vmax, resolution)
+        if new_text is None:
+            shutil.copy(os.path.join(src_dir, name), os.path.join(dst_dir, name))
+            continue
+        with open(os.path.join(dst_dir, name), "w", newline="") as file:
+            file.write(new_text)
+        tabulated.append(mechanism_suffix(text))
+        print(f"tabulated {name}")
+    return tabulated
+
+def mechanism_suffix(text):
+    """SUFFIX (or POINT_PROCESS) name declared in a modfile."""
+    match = re.search(r"\b(?:SUFFIX|POINT_PROCESS|ARTIFICIAL_CELL)\s+(\w+)", text)
+    return match.group(1) if match else None
+
+def set_rate_tables(h, use=True):
+    """
+    Switch every loaded tabulated mechanism between table lookup and the analytic rates.
+
+    Returns:
+      list of the mechanism names that were switched
+    """
+    switched = []
+    mechanisms = h.MechanismType(0)
+    name = h.ref("")
+    for index in range(int(mechanisms.count())):
+        mechanisms.select(index)
+        mechanisms.selected(name)
+        flag = f"usetable_{name[0]}"
+        if hasattr(h, flag):
+            setattr(h, flag, 1 if use else 0)
+            switched.append(name[0])
+    return switched
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write table-driven copies of channel modfiles.")
+    parser.add_argument("src_dir")
+    parser.add_argument("dst_dir")
+    parser.add_argument("--vmin", type=float, default=-100, help="lowest tabulated voltage (mV)")
+    parser.add_argument("--vmax", type=float, default=100, help="highest tabulated voltage (mV)")
+    parser.add_argument("--resolution", type=int, default=200, help="number of table intervals")
+    args = parser.parse_args()
+
+    write_tabulated_modfiles(args.src_dir, args.dst_dir, args.vmin, args.vmax, args.resolution)
@@ -0,0 +1,144 @@
+import os
+
+from automation.compile_cache import neuron_version, registered_mechanisms
+from automation.model_hash import hash_json
+
+def parameter_values(h):
+    """
+    Passive values, ion reversal potentials and mechanism PARAMETERs of every segment,
+    in section order.
+
+    These (unlike the gating states) determine where the cell comes to rest, so a
+    resting state is only reusable while they are unchanged.
+    """
+    standards = {}  # mechanism name -> PARAMETER names
+    ions = sorted(name for name in registered_mechanisms(h) if name.endswith("_ion"))
+    values = [h.celsius]
+    for sec in h.allsec():
+        values += [sec.name(), sec.nseg, sec.Ra]
+        sec_ions = [ion for ion in ions if h.ismembrane(ion, sec=sec)]
+        for seg in sec:
+            values += [seg.diam, seg.cm]
+            # e.g. ena and ek, which load_cell_parameters sets per section type
+            for ion in sec_ions:
+                values += [ion, getattr(seg, "e" + ion[:-len("_ion")])]
+            for mech in seg:
+                name = mech.name()
+                if name not in standards:
+                    standard = h.MechanismStandard(name, 1)
+                    names = []
+                    for i in range(int(standard.count())):
+                        param = h.ref("")
+                        standard.name(param, i)
+                        names.append(param[0])
+                    standards[name] = names
+                values += [name] + [getattr(seg, param) for param in standards[name]]
+    return values
+
+class RestStateCache:
+    def __init__(self, cache_dir="rest_states", v_init=-65.0, settle_time=300.0):
+        """
+        Cache of equilibrated resting states built on h.SaveState.
+
+        A state is created once per model key and set of parameter values by
+        initializing to v_init and simulating settle_time ms without stimulation.
+        Later protocols restore it and can start stimulating at t = 0. States are kept
+        in memory and written to cache_dir so they persist across runs. The current
+        passive, reversal potential and mechanism parameter values (see parameter_values) and the NEURON
+        version are part of each state's id, so changing e.g. g_pas while tuning gives
+        a new state, and SaveState files from another NEURON build are not read.
+
+        Walking every segment for those values costs time on each restore, so a model
+        key's state id is computed once and kept until parameters_changed() is called.
+        RInTuner and DeltaApplier call it when they write to the cell; code that changes
+        parameters (or celsius) by other means must call it too.
+
+        Parameters:
+          cache_dir  : directory the SaveState files are written to
+          v_init     : initial voltage used when creating a state (mV)
+          settle_time: simulated time allowed for the cell to reach rest (ms)
+        """
+        self.cache_dir = cache_dir
+        self.v_init = v_init
+        self.settle_time = settle_time
+        self.states = {}     # state id -> SaveState
+        self.state_ids = {}  # model key -> state id for the current parameter values
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def parameters_changed(self):
+        """Forget the computed state ids; the next restore hashes the cell's parameter values again."""
+        self.state_ids = {}
+
+    def state_id(self, h, key):
+        """Id of the state for a model key, the cell's current parameter values and the settling settings."""
+        if key not in self.state_ids:
+            state = hash_json({"parameters": parameter_values(h), "neuron": neuron_version(),
+                               "v_init": self.v_init, "settle_time": self.settle_time})[:16]
+            self.state_ids[key] = f"{key}_{state}"
+        return self.state_ids[key]
+
+    def state_path(self, state_id):
+        """Path of the SaveState file for a state id."""
+        return os.path.join(self.cache_dir, f"{state_id}.dat")
+
+    def create(self, h, key):
+        """Settle the cell from v_init and save the state under state id key."""
+        h.finitialize(self.v_init)
+        h.continuerun(self.settle_time)
+
+        state = h.SaveState()
+        state.save()
+        self.states[key] = state
+
+        file = h.File(self.state_path(key))
+        file.wopen()
+        state.fwrite(file, 0)
+        file.close()
+        print(f"saved resting state at [ {h.soma[0](0.5).v:.3} ] mV to {self.state_path(key)}")
+        return state
+
+    def load(self, h, key):
+        """Read the state for state id key from disk. Returns None if it has not been saved."""
+        path = self.state_path(key)
+        if not os.path.exists(path):
+            return None
+        state = h.SaveState()
+        file = h.File(path)
+        file.ropen()
+        state.fread(file, 0)
+        file.close()
+        self.states[key] = state
+        return state
+
+    def restore(self, h, key):
+        """
+        Put the cell into the resting state for model key with t reset to 0.
+
+        The state for the current parameter values is taken from memory, then disk,
+        and created if neither has it. Any stimulus must be removed before this call
+        and set up after it, so that a newly created state is not contaminated by it.
+        """
+        key = self.state_id(h, key)
+        state = self.states.get(key)
+        if state is None:
+            state = self.load(h, key)
+        if state is None:
+            state = self.create(h, key)
+
+        # finitialize sets up the event queue and mechanism bookkeeping; restore then overwrites the states
+        h.finitialize(self.v_init)
+        state.restore(1)
+        h.t = 0
+        if h.cvode.active():
+            h.cvode.re_init()
+        else:
+            h.fcurrent()
+        h.frecord_init()
+
+    def clear(self, key=None):
+        """Forget the states of one model key (or every saved state) and remove the files from disk."""
+        prefix = "" if key is None else f"{key}_"
+        self.states = {state_id: state for state_id, state in self.states.items() if not state_id.startswith(prefix)}
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefix) and name.endswith(".dat"):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,132 @@
+import hashlib
+import io
+import json
+import sqlite3
+import time
+
+import numpy as np
+
+from automation.model_hash import hash_json
+
+def result_key(model_key, protocol):
+    """
+    Key for one simulation result.
+
+    Parameters:
+      model_key: key of the built cell (see model_hash.hash_model)
+      protocol : JSON-serializable protocol parameters, e.g. RInSimulation.protocol()
+    """
+    return hashlib.sha256((model_key + hash_json(protocol)).encode("utf-8")).hexdigest()
+
+def _pack_traces(traces):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **{name: np.asarray(values) for name, values in traces.items()})
+    return buffer.getvalue()
+
+def _unpack_traces(blob):
+    with np.load(io.BytesIO(blob)) as data:
+        return {name: data[name] for name in data.files}
+
+class ResultCache:
+    def __init__(self, path="feature_cache.sqlite", max_entries=None, max_bytes=None):
+        """
+        Persistent cache of extracted features (R_in, tau, sag, RMP, rheobase, firing rates, ...)
+        and optional traces, stored in a local SQLite database.
+
+        Entries are evicted least-recently-used first once max_entries or max_bytes
+        (features plus compressed traces) is exceeded.
+
+        Parameters:
+          path       : SQLite database file
+          max_entries: maximum number of stored results (None for no limit)
+          max_bytes  : maximum total stored size in bytes (None for no limit)
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # autocommit; each statement is its own transaction
+        self.connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                features TEXT NOT NULL,
+                traces BLOB,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access)")
+
+    def get(self, key, with_traces=False):
+        """
+        Look up a result.
+
+        Returns:
+          the features dict (or (features, traces) if with_traces), or None on a miss.
+          traces is None if the result was stored without them.
+        """
+        column = "features, traces" if with_traces else "features"
+        row = self.connection.execute(f"SELECT {column} FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+        features = json.loads(row[0])
+        if not with_traces:
+            return features
+        traces = _unpack_traces(row[1]) if row[1] is not None else None
+        return features, traces
+
+    def put(self, key, features, traces=None):
+        """Store features (a JSON-serializable dict) and optional traces (dict of arrays)."""
+        features_json = json.dumps(features)
+        blob = _pack_traces(traces) if traces is not None else None
+        size = len(features_json) + (len(blob) if blob is not None else 0)
+        now = time.time()
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results (key, features, traces, size, created, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, features_json, blob, size, now, now))
+        self.evict()
+
+    def get_or_compute(self, key, compute, with_traces=False):
+        """
+        Return the cached result for key, or call compute() and cache what it returns.
+
+        compute returns a features dict, or (features, traces) when with_traces is True.
+        """
+        cached = self.get(key, with_traces)
+        if cached is not None:
+            return cached
+        result = compute()
+        if with_traces:
+            features, traces = result
+            self.put(key, features, traces)
+        else:
+            self.put(key, result)
+        return result
+
+    def evict(self):
+        """Remove least-recently-used results until the size limits are met."""
+        if self.max_entries is not None:
+            self.connection.execute(
+                "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+        if self.max_bytes is not None:
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            rows = self.connection.execute("SELECT key, size FROM results ORDER BY last_access ASC")
+            to_delete = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                to_delete.append((key,))
+                total -= size
+            self.connection.executemany("DELETE FROM results WHERE key = ?", to_delete)
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def clear(self):
+        self.connection.execute("DELETE FROM results")
+
+    def close(self):
+        self.connection.close()
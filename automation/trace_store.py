@@ -0,0 +1,207 @@
+# On-disk store of simulated traces for sweeps with more runs than fit in memory.
+#
+# example use:
+#   store = TraceStore("fi_sweep.h5")
+#   for amp in amps:
+#       recorder = TraceRecorder(store, f"amp_{amp:.3f}", h, soma_sources(h, channels, currents),
+#                                attrs={"amp": amp})
+#       sim.stim.amp = amp
+#       recorder.run(tstop=1000.0)   # appends to disk every chunk_dur ms of simulated time
+#   ...
+#   v = store.trace("amp_0.200", "v")[3000:7000]   # reads only the chunks covering the slice
+#
+# Layout of the HDF5 file:
+#   /<run_id>                     group per run; attrs: dt, t0 and any run attrs (e.g. amplitude)
+#   /<run_id>/v                   somatic voltage (mV)
+#   /<run_id>/currents/<name>     channel or total ionic currents (mA/cm2)
+#   /<run_id>/intracellular/<sec> voltage at the start of each soma child section (mV); the axial
+#                                 resistance to the soma is stored as the dataset's "axial_resistance"
+#                                 attr so intracellular_current() can compute the current on read
+# Every trace is a 1D, chunked, compressed float32 dataset that can grow while a run is simulated.
+# Time is not stored: with a fixed time step sample k is at t0 + k * dt.
+
+import h5py
+import numpy as np
+
+class TraceStore:
+    def __init__(self, path="traces.h5", mode="a", dtype="float32", chunk_size=4096, compression="gzip",
+                 compression_opts=4):
+        """
+        HDF5 trace store (see module comment).
+
+        Parameters:
+          path            : HDF5 file
+          mode            : h5py file mode ("a" to create or append, "r" for analysis only)
+          dtype           : storage type of the traces
+          chunk_size      : samples per HDF5 chunk; reads and writes touch whole chunks
+          compression     : h5py compression filter ("gzip", "lzf" or None)
+          compression_opts: compression level for gzip
+        """
+        self.path = path
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.compression_opts = compression_opts if compression == "gzip" else None
+        self.file = h5py.File(path, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def run_ids(self):
+        return list(self.file.keys())
+
+    def create_run(self, run_id, names, dt, t0=0.0, attrs=None):
+        """
+        Create the group and empty, growable datasets of a run, replacing any run with the same id.
+
+        Parameters:
+          run_id: key of the run
+          names : trace names, e.g. "v", "currents/ina_NaTa", "intracellular/dend[0]"
+          dt    : time step of the traces (ms)
+          t0    : time of the first sample (ms)
+          attrs : optional JSON-like run metadata stored as group attributes
+        """
+        if run_id in self.file:
+            del self.file[run_id]
+        group = self.file.create_group(run_id)
+        group.attrs["dt"] = dt
+        group.attrs["t0"] = t0
+        for key, value in (attrs or {}).items():
+            group.attrs[key] = value
+        for name in names:
+            group.create_dataset(name, shape=(0,), maxshape=(None,), dtype=self.dtype, chunks=(self.chunk_size,),
+                                 compression=self.compression, compression_opts=self.compression_opts, shuffle=True)
+        return group
+
+    def append(self, run_id, name, values):
+        """Append samples to a trace of an existing run."""
+        dataset = self.file[run_id][name]
+        start = dataset.shape[0]
+        dataset.resize((start + len(values),))
+        dataset[start:] = values
+
+    def write_run(self, run_id, traces, dt, t0=0.0, attrs=None):
+        """Store the complete traces ({name: array or h.Vector}) of a finished run."""
+        group = self.create_run(run_id, traces.keys(), dt, t0, attrs)
+        for name, values in traces.items():
+            values = values.as_numpy() if hasattr(values, "as_numpy") else np.asarray(values)
+            self.append(run_id, name, values)
+        return group
+
+    def trace(self, run_id, name):
+        """
+        Lazy trace: an h5py dataset that reads from disk only when sliced, e.g. trace[1000:2000]
+        or trace[::10]. Use trace[()] to read it all.
+        """
+        return self.file[run_id][name]
+
+    def time(self, run_id, start=0, stop=None):
+        """Sample times (ms) of a run's traces between sample indices start and stop."""
+        group = self.file[run_id]
+        if stop is None:
+            stop = max((dataset.shape[0] for dataset in _datasets(group)), default=0)
+        return group.attrs["t0"] + np.arange(start, stop) * group.attrs["dt"]
+
+    def intracellular_current(self, run_id, section, start=None, stop=None):
+        """Axial current (nA) from the soma into a child section, computed from the stored voltages."""
+        group = self.file[run_id]
+        v_child = group["intracellular"][section]
+        window = slice(start, stop)
+        return (group["v"][window] - v_child[window]) / v_child.attrs["axial_resistance"]
+
+def _datasets(group):
+    for item in group.values():
+        if isinstance(item, h5py.Dataset):
+            yield item
+        else:
+            yield from _datasets(item)
+
+def soma_sources(h, channels=(), currents=(), total_currents=("ica", "ik", "ina"), intracellular=False):
+    """
+    NEURON pointers to record at the soma, by trace name (see module comment).
+
+    Parameters:
+      channels      : mechanism names, e.g. ["NaTa", "Kv3_1"]
+      currents      : the current of each channel, e.g. ["ina", "ik"]
+      total_currents: total ionic currents to record
+      intracellular : also record the voltage at the start of every soma child section
+
+    Returns:
+      ({name: pointer}, {name: dataset attrs})
+    """
+    if len(channels) != len(currents):
+        raise ValueError("channels and currents must be the same length")
+    seg = h.soma[0](0.5)
+    sources = {"v": seg._ref_v}
+    attrs = {}
+    for current in total_currents:
+        sources[f"currents/{current}"] = getattr(seg, f"_ref_{current}")
+    for channel, current in zip(channels, currents):
+        sources[f"currents/{current}_{channel}"] = getattr(seg, f"_ref_{current}_{channel}")
+    if intracellular:
+        soma = h.soma[0]
+        for sec in soma.children():
+            # half-segment axial resistances of the soma and the child (MOhm)
+            soma_half_seg_Ra = .01 * soma.Ra * (soma.L / 2 / soma.nseg) / (np.pi * (sec.parentseg().diam / 2) ** 2)
+            sec_half_seg_Ra = .01 * sec.Ra * (sec.L / 2 / sec.nseg) / (np.pi * (sec(1e-15).diam / 2) ** 2)
+            name = f"intracellular/{sec.name()}"
+            sources[name] = sec(1e-15)._ref_v
+            attrs[name] = {"axial_resistance": soma_half_seg_Ra + sec_half_seg_Ra}
+    return sources, attrs
+
+class TraceRecorder:
+    def __init__(self, store, run_id, h, sources, attrs=None):
+        """
+        Record NEURON variables into a TraceStore while the run is simulated.
+
+        The recording vectors only ever hold the samples of one chunk: after each chunk they are
+        appended to the store and emptied, so memory use does not grow with tstop.
+
+        Parameters:
+          store  : TraceStore the run is written to
+          run_id : key of the run
+          h      : the NEURON h object
+          sources: {name: pointer} or the (sources, dataset attrs) pair returned by soma_sources
+          attrs  : optional run metadata stored as group attributes
+        """
+        self.store = store
+        self.run_id = run_id
+        self.h = h
+        self.sources, self.dataset_attrs = sources if isinstance(sources, tuple) else (sources, {})
+        self.attrs = attrs
+        self.vectors = {}
+        for name, pointer in self.sources.items():
+            self.vectors[name] = h.Vector()
+            self.vectors[name].record(pointer)
+
+    def flush(self):
+        """Append the samples recorded since the last flush and empty the vectors."""
+        for name, vector in self.vectors.items():
+            self.store.append(self.run_id, name, vector.as_numpy())
+            vector.resize(0)
+
+    def run(self, tstop, chunk_dur=100.0):
+        """
+        Initialize and simulate to tstop (ms) with the current h.dt, writing every chunk_dur ms.
+
+        Fixed time step only: time is implied by the run's dt and t0 attrs.
+        """
+        h = self.h
+        h.tstop = tstop
+        h.stdinit()
+        group = self.store.create_run(self.run_id, self.vectors.keys(), h.dt, h.t, self.attrs)
+        for name, attrs in self.dataset_attrs.items():
+            group[name].attrs.update(attrs)
+        # the vectors hold the sample taken at initialization
+        self.flush()
+        while h.t < tstop - h.dt / 2:
+            h.continuerun(min(h.t + chunk_dur, tstop))
+            self.flush()
+        self.store.file.flush()
+        return group
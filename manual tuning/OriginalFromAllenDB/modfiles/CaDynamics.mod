@@ -2,6 +2,7 @@
 : modified from Destexhe et al. 1994
 
 NEURON	{
+	THREADSAFE
 	SUFFIX CaDynamics
 	USEION ca READ ica WRITE cai
 	RANGE decay, gamma, minCai, depth
@@ -1,6 +1,7 @@
 : Reference:		Reuveni, Friedman, Amitai, and Gutnick, J.Neurosci. 1993
 
 NEURON	{
+	THREADSAFE
 	SUFFIX Ca_HVA
 	USEION ca READ eca WRITE ica
 	RANGE gbar, g, ica 
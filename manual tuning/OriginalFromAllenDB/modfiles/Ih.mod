@@ -1,6 +1,7 @@
 : Reference:		Kole,Hallermann,and Stuart, J. Neurosci. 2006
 
 NEURON	{
+	THREADSAFE
 	SUFFIX Ih
 	NONSPECIFIC_CURRENT ihcn
 	RANGE gbar, g, ihcn 
@@ -2,6 +2,7 @@
 
 
 NEURON	{
+	THREADSAFE
 	SUFFIX Kd
 	USEION k READ ek WRITE ik
 	RANGE gbar, g, ik
@@ -2,6 +2,7 @@
 : Comment: corrected rates using q10 = 2.3, target temperature 34, orginal 21
 
 NEURON	{
+	THREADSAFE
 	SUFFIX Im
 	USEION k READ ek WRITE ik
 	RANGE gbar, g, ik
@@ -2,6 +2,7 @@
 : Reference:		Voltage-gated K+ channels in layer 5 neocortical pyramidal neurones from young rats:subtypes and gradients,Korngreen and Sakmann, J. Physiology, 2000
 
 NEURON	{
+	THREADSAFE
 	SUFFIX K_T
 	USEION k READ ek WRITE ik
 	RANGE gbar, g, ik
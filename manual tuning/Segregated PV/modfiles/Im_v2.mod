@@ -1,6 +1,7 @@
 : Based on Im model of Vervaeke et al. (2006)
 
 NEURON	{
+	THREADSAFE
 	SUFFIX Im_v2
 	USEION k READ ek WRITE ik
 	RANGE gbar, g, ik
@@ -2,6 +2,7 @@
 :Comment: corrected rates using q10 = 2.3, target temperature 34, orginal 21
 
 NEURON	{
+	THREADSAFE
 	SUFFIX Nap
 	USEION na READ ena WRITE ina
 	RANGE gbar, g, ina
@@ -3,6 +3,7 @@
 
 
 NEURON	{
+	THREADSAFE
 	SUFFIX K_P
 	USEION k READ ek WRITE ik
 	RANGE gbar, g, ik
@@ -4,6 +4,7 @@
 
 
 NEURON	{
+	THREADSAFE
 	SUFFIX Kv2like
 	USEION k READ ek WRITE ik
 	RANGE gbar, g, ik
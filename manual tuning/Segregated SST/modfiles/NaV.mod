@@ -3,6 +3,7 @@ TITLE Mouse sodium current
 : Based on 37 degC recordings from mouse hippocampal CA1 pyramids
 
 NEURON {
+  THREADSAFE
   SUFFIX NaV
   USEION na READ ena WRITE ina
   RANGE g, gbar
@@ -0,0 +1,63 @@
+# Builds CellPopulation copies from a real Allen SWC reconstruction.
+#
+# run from the repository root (so that the automation package is importable):
+#   python -m pytest tests
+#
+# Only the passive part of the fit's genome is used, so no modfiles need to be compiled.
+
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("neuron")
+pytest.importorskip("matplotlib")
+
+from neuron import h
+
+from automation.cell_builder import section_type
+from automation.population import CellPopulation
+
+CELL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        "manual tuning", "OriginalFromAllenDB")
+SWC_PATH = os.path.join(CELL_DIR, "Sst-IRES-Cre_Ai14-188740.03.02.01_657210399_m.swc")
+
+def passive_utils():
+    """Stand-in for allensdk Utils with the fit's passive parameters and the real morphology."""
+    with open(os.path.join(CELL_DIR, "476686112_fit.json")) as file:
+        data = json.load(file)
+    data["genome"] = [entry for entry in data["genome"] if entry["mechanism"] == ""]
+    manifest = SimpleNamespace(get_path=lambda key: SWC_PATH)
+    return SimpleNamespace(h=h, description=SimpleNamespace(manifest=manifest, data=data))
+
+def test_builds_one_copy_from_swc():
+    utils = passive_utils()
+    population = CellPopulation(utils, [[]])
+
+    assert len(population.cells) == 1
+    cell = population.cells[0]
+    types = set(section_type(sec) for sec in cell.all)
+    assert {"soma", "dend", "axon"} <= types
+    assert len(list(cell.somatic)) == 1
+    assert len(list(cell.axon)) == 2
+    # the fit has no apic cm entry; every listed type gets its cm
+    cm = {entry["section"]: entry["cm"] for entry in utils.description.data["passive"][0]["cm"]}
+    for sec in cell.all:
+        if section_type(sec) in cm:
+            assert sec.cm == pytest.approx(cm[section_type(sec)])
+    # only the copies are simulated
+    assert all(sec.cell() is not None for sec in h.allsec())
+
+def test_copies_get_their_own_overrides():
+    utils = passive_utils()
+    g_pas = [entry["value"] for entry in utils.description.data["genome"]
+             if entry["section"] == "soma" and entry["name"] == "g_pas"][0]
+    overrides = [[], [{"section": "soma", "name": "g_pas", "value": 2 * float(g_pas)}]]
+    population = CellPopulation(utils, overrides)
+
+    r_in = population.measure_r_in(stim_amp=-0.05, stim_delay=50.0, stim_dur=300.0, tstop=400.0)
+    assert len(r_in) == 2
+    assert r_in[0] > 0
+    # a leakier soma lowers the input resistance
+    assert r_in[1] < r_in[0]